@@ -1,142 +1,100 @@
 import sys
-import ast
-import operator as op
-import argparse
-import math
-import re
 
-# Парсер аргументов командной строки
-parser = argparse.ArgumentParser(
-    prog="Калькулятор",
-    description="""Вычисление математических выражений с поддержкой:
-    - Базовых операций: +, -, *, /, ^ 
-    - Тригонометрических функций: sin, cos, tg, ctg
-    - Других математических функций: sqrt (квадратный корень), ln (натуральный логарифм), exp (экспонента)
-    - Констант: pi, e 
-    - Поддержка градусов и радиан для тригонометрических функций""",
-    epilog="Примеры использования:\n"
-           "  python3 calc.py '2^3 + cos(0)'",
-    formatter_class=argparse.RawDescriptionHelpFormatter
+import calc_core
+from calc_core import (
+    operators, functions, constants, trig_functions,
+    Number, Name, BinOp, UnaryOp, Call, from_ast,
+    parse, postorder, depth, evaluate, calculate, optimize, compile_expression,
+    CacheInfo, LRUCache, expression_cache, result_cache, configure_cache, cache_info, cache_clear,
+    configure_limits, Profile, ProfileStats, enable_profiling, disable_profiling, Evaluator, Function,
+    BatchResult, calculate_batch, batch_line, run_batch, calculate_many,
+    Result, validate, try_calculate,
 )
-parser.add_argument("expression", nargs="?", help="Математическое выражение для вычисления.")
-parser.add_argument("--angle-unit", choices=["degree", "radian"], default="radian",
-                   help="Единицы измерения углов для тригонометрических функций (по умолчанию: radian)")
 
-operators = {
-    ast.Add: op.add,
-    ast.Sub: op.sub,
-    ast.Mult: op.mul,
-    ast.Div: op.truediv,
-    ast.USub: op.neg,
-    ast.Pow: op.pow,
-}
+# Вычисления находятся в calc_core, здесь - командная строка. Остальные
+# имена, в том числе изменяемые настройки (cache_enabled, profiler,
+# node_limit и другие), читаются из calc_core при обращении, поэтому
+# calc.profiler всегда совпадает с calc_core.profiler
+def __getattr__(name):
+    if name == 'parser':
+        return _parser()
+    return getattr(calc_core, name)
 
-functions = {
-    'sqrt': math.sqrt,
-    'sin': math.sin,
-    'cos': math.cos,
-    'tg': math.tan,
-    'ctg': lambda x: 1/math.tan(x),
-    'ln': math.log,
-    'exp': math.exp,
-}
+_cli_parser = None
 
-constants = {
-    'pi': math.pi,
-    'e': math.e,
-}
+def _parser():
+    # Парсер аргументов командной строки создается при первом обращении,
+    # поэтому импорт calc как библиотеки не загружает argparse
+    global _cli_parser
+    if _cli_parser is not None:
+        return _cli_parser
+    import argparse
 
-def parse(expression):
-    # Преобразуем выражение в дерево AST
-    try:
-        # Удаляем лишние пробелы
-        expression = " ".join(expression.split())
-        
-        # Проверяем на наличие недопустимых символов
-        allowed_chars = set('+-*/^() .0123456789eE')
-        allowed_pattern = re.compile(r'^[+\-*/^() .\d\s]*|[a-z]+\(|pi|e')
-        
-        # Разрешаем буквы только в названиях функций и констант
-        for token in re.findall(r'[a-zA-Z]+', expression):
-            if token not in functions and token not in constants and not token.startswith(('sqrt', 'sin', 'cos', 'tg', 'ctg', 'ln', 'exp')):
-                raise ValueError(f"Выражение содержит неверные символы: {token}")
-        
-        # Заменяем ^ на ** для корректного парсинга
-        expression = expression.replace('^', '**')
-        
-        # Парсим выражение в AST
-        tree = ast.parse(expression, mode='eval')
-        return tree.body
-    except SyntaxError as e:
-        if "invalid syntax" in str(e):
-            raise ValueError("Некорректное выражение: Неполное выражение")
-        else:
-            raise ValueError(f"Некорректное выражение: {e}")
-    except (TypeError, KeyError, ValueError) as e:
-        raise ValueError(f"Некорректное выражение: {e}")
-
-def evaluate(node, angle_unit='radian'):
-    # Рекурсивно вычисляем значение выражения, представленного в виде AST
-    if isinstance(node, ast.Constant):
-        return node.value
-    elif isinstance(node, ast.BinOp):
-        left = evaluate(node.left, angle_unit)
-        right = evaluate(node.right, angle_unit)
-        return operators[type(node.op)](left, right)
-    elif isinstance(node, ast.UnaryOp):
-        operand = evaluate(node.operand, angle_unit)
-        return operators[type(node.op)](operand)
-    elif isinstance(node, ast.Name):
-        if node.id in constants:
-            return constants[node.id]
-        raise ValueError(f"Неизвестная константа: {node.id}")
-    elif isinstance(node, ast.Call):
-        func_name = node.func.id
-        if func_name not in functions:
-            raise ValueError(f"Неизвестная функция: {func_name}")
-        
-        args = [evaluate(arg, angle_unit) for arg in node.args]
-        if len(args) != 1:
-            raise ValueError(f"Функция {func_name} принимает ровно 1 аргумент")
-        
-        value = args[0]
-        if func_name in ['sin', 'cos', 'tg', 'ctg'] and angle_unit == 'degree':
-            value = math.radians(value)
-        
-        try:
-            return functions[func_name](value)
-        except ValueError as e:
-            raise ValueError(f"Ошибка в функции {func_name}: {e}")
-    else:
-        raise TypeError(f"Неверное выражение: неподдерживаемый узел AST {type(node)}")
+    parser = argparse.ArgumentParser(
+        prog="Калькулятор",
+        description="""Вычисление математических выражений с поддержкой:
+    - Базовых операций: +, -, *, /, ^
+    - Тригонометрических функций: sin, cos, tg, ctg
+    - Других математических функций: sqrt (квадратный корень), ln (натуральный логарифм), exp (экспонента)
+    - Констант: pi, e
+    - Поддержка градусов и радиан для тригонометрических функций""",
+        epilog="Примеры использования:\n"
+               "  python3 calc.py '2^3 + cos(0)'\n"
+               "  python3 calc.py --batch formulas.txt --workers 4\n"
+               "  cat formulas.jsonl | python3 calc.py --batch --format jsonl\n"
+               "  python3 calc.py serve --port 8765   (сервер, см. python3 calc.py serve -h)\n"
+               "  python3 calc.py client --port 8765 < formulas.txt\n"
+               "  python3 calc.py sample 'tg(x)' --range x 0 3 --adaptive   (сетка, см. python3 calc.py sample -h)",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("expression", nargs="?", help="Математическое выражение для вычисления.")
+    parser.add_argument("--angle-unit", choices=["degree", "radian"], default="radian",
+                       help="Единицы измерения углов для тригонометрических функций (по умолчанию: radian)")
+    parser.add_argument("--batch", nargs="?", const="-", metavar="FILE",
+                       help="Пакетный режим: выражения по одному на строку из файла или stdin (если файл не указан)")
+    parser.add_argument("--format", choices=["text", "jsonl"], default="text",
+                       help="Формат строк пакетного режима: текст или JSON Lines с полями expression, angle_unit, "
+                            "variables и result/error (по умолчанию: text)")
+    parser.add_argument("--workers", type=int, default=1,
+                       help="Число процессов для пакетного режима (по умолчанию: 1)")
+    parser.add_argument("--profile", action="store_true",
+                       help="Вывести в stderr время этапов, число узлов, глубину дерева и вызовы функций "
+                            "(в пакетном режиме только с --workers 1)")
+    _cli_parser = parser
+    return parser
 
-def calculate(expression, angle_unit='radian'):
-    try:
-        # Если выражение является строкой, парсим его в AST
-        if isinstance(expression, str):
-            tree = parse(expression)
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] in (["serve"], ["client"]):
+        from calc_server import main as server_main
+        return server_main(argv)
+    if argv[:1] == ["sample"]:
+        from calc_sample import main as sample_main
+        return sample_main(argv[1:])
+    parser = _parser()
+    args = parser.parse_args(argv)
+    if args.profile:
+        if args.batch is not None and args.workers > 1:
+            parser.error("--profile в пакетном режиме работает только с --workers 1")
+        import atexit
+        atexit.register(lambda stats: print(stats.report(), file=sys.stderr), enable_profiling())
+    if args.batch is not None:
+        if args.batch == "-":
+            errors = run_batch(sys.stdin, sys.stdout, args.angle_unit, args.format, args.workers)
         else:
-            tree = expression
-        result = evaluate(tree, angle_unit)
-        if math.isinf(result) or math.isnan(result):
-            raise OverflowError("Арифметическое переполнение.")
-        return result
-    except (SyntaxError, TypeError, KeyError) as e:
-        raise ValueError(f"Некорректное выражение: {e}")
-    except ZeroDivisionError:
-        raise ZeroDivisionError("Деление на ноль.")
-    except OverflowError:
-        raise OverflowError("Арифметическое переполнение.")
-
-if __name__ == "__main__":
-    args = parser.parse_args()
+            with open(args.batch, encoding="utf-8") as lines:
+                errors = run_batch(lines, sys.stdout, args.angle_unit, args.format, args.workers)
+        return 1 if errors else 0
     if not args.expression:
         parser.print_help()
-        sys.exit(1)
-    expression = args.expression
+        return 1
     try:
-        result = calculate(expression, args.angle_unit)
+        result = calculate(args.expression, args.angle_unit)
         print(f"Результат: {result}")
     except Exception as e:
         print(e, file=sys.stderr)
-        sys.exit(1)
\ No newline at end of file
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
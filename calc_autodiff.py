@@ -0,0 +1,258 @@
+import math
+import ast
+from collections import namedtuple
+
+import calc_core
+from calc_core import Number, Name, BinOp, UnaryOp, Call, constants, functions, trig_functions
+
+# Прямое автоматическое дифференцирование: каждый узел дерева вычисляется
+# в пару (значение, градиент по всем переменным), поэтому значение и все
+# частные производные получаются за один обход дерева. Градиент константы -
+# None, такие поддеревья не тратят время на производные
+
+# Значение выражения и словарь частных производных: имя переменной -> производная
+Derivative = namedtuple('Derivative', ['value', 'gradient'])
+
+# Производные функций: m - модуль math или numpy, x - аргумент (у
+# тригонометрических функций - в радианах), y - значение функции в x
+_derivatives = {
+    'sqrt': lambda m, x, y: 0.5 / y,
+    'sin': lambda m, x, y: m.cos(x),
+    'cos': lambda m, x, y: -m.sin(x),
+    'tg': lambda m, x, y: 1 + y * y,
+    'ctg': lambda m, x, y: -(1 + y * y),
+    'ln': lambda m, x, y: 1 / x,
+    'exp': lambda m, x, y: y,
+}
+
+# Производная перевода градусов в радианы
+_degree = math.pi / 180
+
+class _Scalar:
+    # Вычисление над числами: значения как в calculate(), градиенты - списки
+    m = math
+
+    def __init__(self, angle_unit):
+        self.angle_unit = angle_unit
+
+    @staticmethod
+    def number(value):
+        return value
+
+    def binary(self, operation, left, right):
+        return calc_core._checked_operators[operation](left, right)
+
+    def call(self, func_name, value):
+        if func_name in trig_functions and self.angle_unit == 'degree':
+            value = math.radians(value)
+        try:
+            return functions[func_name](value)
+        except ValueError as e:
+            raise ValueError(f"Ошибка в функции {func_name}: {e}")
+
+    def coefficient(self, func, *args):
+        # Бесконечная производная (sqrt в нуле и т.п.) - переполнение, а не
+        # деление на ноль в выражении
+        try:
+            return func(*args)
+        except ZeroDivisionError:
+            raise OverflowError("Арифметическое переполнение.")
+
+    def exponent(self, base, value):
+        # Производная base^b по показателю: base^b * ln(base)
+        if base > 0:
+            return value * math.log(base)
+        if base == 0 and value == 0:
+            return 0.0
+        if base == 0:
+            raise OverflowError("Арифметическое переполнение.")
+        raise ValueError("Производная степени по показателю не определена при отрицательном основании")
+
+    @staticmethod
+    def scale(gradient, factor):
+        return [factor * x for x in gradient]
+
+    @staticmethod
+    def add(first, second):
+        if first is None or second is None:
+            return second if first is None else first
+        return [x + y for x, y in zip(first, second)]
+
+class _Array(calc_core._ArrayEvaluator):
+    # Вычисление над массивами NumPy: ошибки отмечаются в масках, как в
+    # calculate_batch(), градиенты - массивы формы (число переменных, *shape)
+    def __init__(self, np, shape, angle_unit, columns):
+        super().__init__(np, shape, angle_unit, columns)
+        self.m = np
+
+    def coefficient(self, func, *args):
+        return func(*args)
+
+    def exponent(self, base, value):
+        np = self.np
+        return np.where(value == 0, 0.0, value * np.log(base))
+
+    @staticmethod
+    def scale(gradient, factor):
+        return gradient * factor
+
+    @staticmethod
+    def add(first, second):
+        if first is None or second is None:
+            return second if first is None else first
+        return first + second
+
+def _power_base(base, exponent):
+    # Производная base^exponent по основанию
+    return exponent * (base * 1.0) ** (exponent - 1)
+
+def _walk(order, backend, values, seeds):
+    # Обход дерева в обратной польской записи со стеком пар (значение, градиент).
+    # values - значения переменных, seeds - их градиенты
+    if calc_core.node_limit:
+        calc_core._check_size(len(order))
+    if calc_core.time_limit:
+        order = calc_core._deadline(order)
+    m = backend.m
+    coefficient = backend.coefficient
+    add = backend.add
+    scale = backend.scale
+    degree = backend.angle_unit == 'degree'
+    stack = []
+    for node in order:
+        if isinstance(node, Number):
+            stack.append((backend.number(node.value), None))
+        elif isinstance(node, BinOp):
+            right, right_gradient = stack.pop()
+            left, left_gradient = stack[-1]
+            operation = node.op
+            value = backend.binary(operation, left, right)
+            if left_gradient is None and right_gradient is None:
+                gradient = None
+            elif operation is ast.Add:
+                gradient = add(left_gradient, right_gradient)
+            elif operation is ast.Sub:
+                gradient = add(left_gradient, None if right_gradient is None else scale(right_gradient, -1))
+            elif operation is ast.Mult:
+                gradient = add(None if left_gradient is None else scale(left_gradient, right),
+                               None if right_gradient is None else scale(right_gradient, left))
+            elif operation is ast.Div:
+                gradient = add(None if left_gradient is None else scale(left_gradient, 1 / right),
+                               None if right_gradient is None else scale(right_gradient, -value / right))
+            elif operation is ast.Pow:
+                # Степень: b * a^(b - 1) по основанию и a^b * ln(a) по показателю
+                if left_gradient is not None:
+                    left_gradient = scale(left_gradient, coefficient(_power_base, left, right))
+                if right_gradient is not None:
+                    right_gradient = scale(right_gradient, backend.exponent(left, value))
+                gradient = add(left_gradient, right_gradient)
+            else:
+                raise TypeError(f"Неверное выражение: неподдерживаемая операция {operation}")
+            stack[-1] = (value, gradient)
+        elif isinstance(node, UnaryOp):
+            value, gradient = stack[-1]
+            stack[-1] = (calc_core.operators[node.op](value), None if gradient is None else scale(gradient, -1))
+        elif isinstance(node, Name):
+            if node.id in constants:
+                stack.append((backend.number(constants[node.id]), None))
+            elif node.id in values:
+                stack.append((values[node.id], seeds[node.id]))
+            else:
+                raise ValueError(f"Неизвестная константа: {node.id}")
+        elif isinstance(node, Call):
+            func_name = node.func
+            if func_name not in functions:
+                raise ValueError(f"Неизвестная функция: {func_name}")
+            if len(node.args) != 1:
+                raise ValueError(f"Функция {func_name} принимает ровно 1 аргумент")
+            argument, gradient = stack[-1]
+            value = backend.call(func_name, argument)
+            if gradient is not None:
+                derivative = _derivatives.get(func_name)
+                if derivative is None:
+                    raise ValueError(f"Производная функции {func_name} не задана")
+                trig = degree and func_name in trig_functions
+                x = m.radians(argument) if trig else argument
+                factor = coefficient(derivative, m, x, value)
+                gradient = scale(gradient, factor * _degree if trig else factor)
+            stack[-1] = (value, gradient)
+        else:
+            raise TypeError(f"Неверное выражение: неподдерживаемый узел AST {type(node)}")
+    return stack[0]
+
+# Разобранные выражения gradient(): узлы в обратной польской записи по
+# тексту выражения и именам переменных. Текст не нормализуется: в цикле
+# оптимизации выражение одно и то же, а нормализация стоит дороже поиска
+_orders = calc_core.LRUCache(256)
+
+def _order(expression, names):
+    if not isinstance(expression, str) or not calc_core.cache_enabled:
+        return calc_core.postorder(calc_core._to_tree(expression, names))
+    key = (expression, tuple(sorted(names)))
+    order = _orders.get(key)
+    if order is None:
+        order = calc_core.postorder(calc_core.parse(*key))
+        _orders.put(key, order)
+    return order
+
+def gradient(expression, angle_unit='radian', variables=None):
+    # Значение выражения и частные производные по всем переменным за один
+    # обход дерева. Ошибки те же, что у calculate(); бесконечная или
+    # неопределенная производная - переполнение
+    variables = variables or {}
+    names = tuple(variables)
+    seeds = {}
+    for i, name in enumerate(names):
+        seed = [0.0] * len(names)
+        seed[i] = 1.0
+        seeds[name] = seed
+    try:
+        value, partials = _walk(_order(expression, names), _Scalar(angle_unit), variables, seeds)
+        if partials is None:
+            partials = [0.0] * len(names)
+        if math.isinf(value) or math.isnan(value) or not all(map(math.isfinite, partials)):
+            raise OverflowError("Арифметическое переполнение.")
+        return Derivative(value, dict(zip(names, partials)))
+    except (SyntaxError, TypeError, KeyError) as e:
+        raise ValueError(f"Некорректное выражение: {e}")
+    except ZeroDivisionError:
+        raise ZeroDivisionError("Деление на ноль.")
+    except OverflowError:
+        raise OverflowError("Арифметическое переполнение.")
+
+def gradient_batch(expression, angle_unit='radian', **columns):
+    # gradient() над столбцами значений переменных за один векторный проход.
+    # Возвращает Derivative, в котором value - BatchResult, как у
+    # calculate_batch(), а gradient - массивы производных; в элементах с
+    # ошибкой значение и производные равны nan
+    import numpy as np
+
+    names = tuple(columns)
+    try:
+        tree = calc_core._to_tree(expression, names)
+        columns = {name: np.asarray(column, dtype=np.float64) for name, column in columns.items()}
+        shape = np.broadcast_shapes(*(column.shape for column in columns.values()))
+        evaluator = _Array(np, shape, angle_unit, columns)
+        # Начальные градиенты формы (число переменных, 1, ...): полную форму
+        # они получают при первом умножении на значения
+        seeds = {}
+        for i, name in enumerate(names):
+            seed = np.zeros((len(names),) + (1,) * len(shape))
+            seed[i] = 1.0
+            seeds[name] = seed
+        with np.errstate(all='ignore'):
+            value, partials = _walk(calc_core.postorder(tree), evaluator, columns, seeds)
+            values = np.array(np.broadcast_to(value, shape), dtype=np.float64)
+            full = (len(names),) + shape
+            partials = np.zeros(full) if partials is None else np.array(np.broadcast_to(partials, full),
+                                                                       dtype=np.float64)
+            evaluator.flag(evaluator.overflow, ~np.isfinite(values) | np.isinf(partials).any(axis=0))
+            evaluator.flag(evaluator.invalid, np.isnan(partials).any(axis=0))
+    except (SyntaxError, TypeError, KeyError) as e:
+        raise ValueError(f"Некорректное выражение: {e}")
+
+    result = calc_core.BatchResult(values, evaluator.zero_division, evaluator.overflow, evaluator.invalid)
+    mask = result.mask
+    values[mask] = np.nan
+    partials[:, mask] = np.nan
+    return Derivative(result, dict(zip(names, partials)))
@@ -0,0 +1,293 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import subprocess
+
+import calc
+
+# Профили синтетических выражений: число слагаемых верхнего уровня, глубина
+# вложенности и набор функций
+PROFILES = {
+    'short': {'length': 5, 'depth': 1, 'functions': ('sin', 'sqrt')},
+    'long': {'length': 200, 'depth': 2, 'functions': ('sin', 'cos', 'sqrt', 'ln', 'exp', 'tg')},
+    'deep': {'length': 10, 'depth': 6, 'functions': ('sqrt', 'ln', 'exp')},
+    'trig': {'length': 50, 'depth': 1, 'functions': ('sin', 'cos', 'tg', 'ctg')},
+}
+
+def _term(rng, depth, functions, variables):
+    # Слагаемое: число, переменная, вызов функции или группа в скобках
+    roll = rng.random()
+    if depth > 0 and roll < 0.3 and functions:
+        func_name = rng.choice(functions)
+        inner = _group(rng, 3, depth - 1, functions, variables)
+        # Аргументы выбираются так, чтобы не выйти из области определения
+        if func_name in ('sqrt', 'ln'):
+            return f"{func_name}(({inner})^2 + 1)"
+        if func_name == 'exp':
+            return f"exp(sin({inner}))"
+        if func_name == 'ctg':
+            return f"ctg(({inner})^2 + 1)"
+        return f"{func_name}({inner})"
+    if depth > 0 and roll < 0.45:
+        return f"({_group(rng, 3, depth - 1, functions, variables)})"
+    if variables and roll < 0.6:
+        return rng.choice(variables)
+    return str(round(rng.uniform(0.1, 10), rng.choice([0, 1, 3])))
+
+def _group(rng, length, depth, functions, variables):
+    parts = [_term(rng, depth, functions, variables)]
+    for _ in range(length - 1):
+        operator = rng.choice(['+', '-', '*', '/'])
+        term = _term(rng, depth, functions, variables)
+        # Делим только на положительное, чтобы не получить деление на ноль
+        parts.append(f"/ ({term}^2 + 1)" if operator == '/' else f"{operator} {term}")
+    return " ".join(parts)
+
+def generate_expression(length=10, depth=1, functions=('sin', 'cos', 'sqrt', 'ln', 'exp', 'tg'),
+                        variables=(), seed=0):
+    # Детерминированное случайное выражение без ошибок вычисления
+    for attempt in range(100):
+        rng = random.Random(seed * 100 + attempt)
+        expression = _group(rng, length, depth, tuple(functions), tuple(variables))
+        try:
+            calc.calculate(expression, variables={name: 1.5 for name in variables})
+            return expression
+        except (ValueError, ArithmeticError):
+            continue
+    raise ValueError("Не удалось построить выражение без ошибок")
+
+def percentile(samples, fraction):
+    # Процентиль по отсортированной выборке (метод ближайшего ранга)
+    index = max(0, min(len(samples) - 1, int(round(fraction * len(samples))) - 1))
+    return samples[index]
+
+def measure(func, repeat=1000, warmup=10):
+    # Время каждого вызова в наносекундах и сводная статистика
+    for _ in range(warmup):
+        func()
+    clock = time.perf_counter_ns
+    samples = []
+    for _ in range(repeat):
+        start = clock()
+        func()
+        samples.append(clock() - start)
+    return summary(samples)
+
+def summary(samples):
+    # Сводная статистика по замерам в наносекундах
+    samples = sorted(samples)
+    mean = sum(samples) / len(samples)
+    return {
+        'runs': len(samples),
+        'mean_ns': mean,
+        'min_ns': samples[0],
+        'p50_ns': percentile(samples, 0.50),
+        'p90_ns': percentile(samples, 0.90),
+        'p99_ns': percentile(samples, 0.99),
+        'ops_per_s': 1e9 / mean if mean else float('inf'),
+    }
+
+# Допустимое время импорта calc и первого вызова calculate() в новом процессе
+IMPORT_BUDGET_MS = 30
+FIRST_CALL_BUDGET_MS = 5
+
+_startup_script = """
+import time
+start = time.perf_counter_ns()
+import calc
+imported = time.perf_counter_ns()
+calc.calculate('2 * sin(pi / 4) + 1')
+done = time.perf_counter_ns()
+import sys
+print(imported - start, done - imported, ' '.join(sorted(sys.modules)))
+"""
+
+def measure_startup(repeat=10):
+    # Время импорта calc и первого вызова calculate() в новых процессах, а
+    # также модули, загруженные к концу первого вызова. Модули калькулятора
+    # предварительно компилируются в байткод, как после установки
+    import compileall
+    directory = os.path.dirname(os.path.abspath(__file__))
+    for name in ('calc.py', 'calc_core.py'):
+        compileall.compile_file(os.path.join(directory, name), quiet=2)
+    imports, first_calls = [], []
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, '-c', _startup_script], cwd=directory, check=True,
+                                capture_output=True, text=True).stdout.split()
+        imports.append(int(output[0]))
+        first_calls.append(int(output[1]))
+        modules = set(output[2:])
+    return {'startup/import': summary(imports), 'startup/first-call': summary(first_calls)}, modules
+
+def measure_threads(name, expression, threads=(1, 2, 4), calls=20000, variables=None):
+    # Пропускная способность Evaluator.calculate() из пула потоков: calls
+    # вызовов делятся между потоками поровну. ops_per_s - общее число вызовов
+    # в секунду по времени работы пула; на сборке CPython без GIL она растет
+    # с числом потоков
+    from concurrent.futures import ThreadPoolExecutor
+
+    evaluator = calc.Evaluator()
+    for _ in range(2):
+        evaluator.calculate(expression, variables)
+    results = {}
+    for count in threads:
+        def work(_, n=calls // count):
+            clock = time.perf_counter_ns
+            samples = []
+            for _ in range(n):
+                start = clock()
+                evaluator.calculate(expression, variables)
+                samples.append(clock() - start)
+            return samples
+
+        with ThreadPoolExecutor(count) as pool:
+            start = time.perf_counter_ns()
+            samples = [sample for chunk in pool.map(work, range(count)) for sample in chunk]
+            elapsed = time.perf_counter_ns() - start
+        stats = summary(samples)
+        stats['ops_per_s'] = len(samples) * 1e9 / elapsed
+        results[f"threads-{count}/{name}"] = stats
+    return results
+
+def _scenarios(name, expression):
+    # Этапы вычисления одного выражения: разбор, обход дерева, полный
+    # calculate() без кэша, calculate() с попаданием в кэш выражений и в кэш
+    # результатов, вызов скомпилированной функции, а также ошибочные
+    # выражения через исключения и через try_calculate()
+    tree = calc.parse(expression)
+    compiled = calc.compile_expression(expression)
+
+    def cold():
+        calc.configure_cache(enabled=False)
+        try:
+            calc.calculate(expression)
+        finally:
+            calc.configure_cache(enabled=True)
+
+    def cached_result():
+        calc.configure_cache(result_maxsize=16)
+        try:
+            calc.calculate(expression)
+        finally:
+            calc.configure_cache(result_maxsize=0)
+
+    invalid = expression + " +"
+    zero_division = f"({expression}) / 0"
+
+    def calculate_invalid():
+        try:
+            calc.calculate(invalid)
+        except ValueError:
+            pass
+
+    return {
+        f"parse/{name}": lambda: calc.parse(expression),
+        f"evaluate/{name}": lambda: calc.evaluate(tree),
+        f"calculate-cold/{name}": cold,
+        f"calculate-cached/{name}": lambda: calc.calculate(expression),
+        f"calculate-result-cache/{name}": cached_result,
+        f"compiled/{name}": compiled,
+        # Ошибочные выражения: исключение против результата try_calculate()
+        f"calculate-invalid/{name}": calculate_invalid,
+        f"try-ok/{name}": lambda: calc.try_calculate(expression),
+        f"try-invalid/{name}": lambda: calc.try_calculate(invalid),
+        f"try-zero-division/{name}": lambda: calc.try_calculate(zero_division),
+        f"validate/{name}": lambda: calc.validate(expression),
+        f"validate-invalid/{name}": lambda: calc.validate(invalid),
+    }
+
+def run_benchmarks(profiles=None, repeat=1000, seed=0):
+    # Запускаем все сценарии и возвращаем отчет, пригодный для сохранения в JSON
+    profiles = profiles or PROFILES
+    scenarios = {}
+    for name, profile in profiles.items():
+        expression = generate_expression(seed=seed, **profile)
+        scenarios.update(_scenarios(name, expression))
+        if name == 'trig':
+            for unit in ('radian', 'degree'):
+                scenarios[f"trig-{unit}/{name}"] = (
+                    lambda unit=unit, tree=calc.parse(expression): calc.evaluate(tree, unit))
+
+    results = {}
+    for scenario, func in scenarios.items():
+        results[scenario] = measure(func, repeat)
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'platform': platform.platform(),
+            'gil': getattr(sys, '_is_gil_enabled', lambda: True)(),
+            'repeat': repeat,
+            'seed': seed,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        },
+        'results': results,
+    }
+
+def compare(report, baseline, threshold=0.2, metric='p50_ns'):
+    # Сценарии, ставшие медленнее базовых более чем на threshold
+    regressions = []
+    for scenario, stats in report['results'].items():
+        base = baseline['results'].get(scenario)
+        if base is None or not base[metric]:
+            continue
+        ratio = stats[metric] / base[metric]
+        if ratio > 1 + threshold:
+            regressions.append((scenario, base[metric], stats[metric], ratio))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="Калькулятор: бенчмарки",
+        description="Замер разбора, вычисления, кэша и тригонометрии на синтетических выражениях.")
+    parser.add_argument("--repeat", type=int, default=1000, help="Число замеров на сценарий (по умолчанию: 1000)")
+    parser.add_argument("--profile", action="append", choices=sorted(PROFILES),
+                        help="Профиль выражений; можно указать несколько (по умолчанию: все)")
+    parser.add_argument("--seed", type=int, default=0, help="Начальное значение генератора выражений")
+    parser.add_argument("--startup", action="store_true",
+                        help="Замерить также импорт calc и первый вызов в новом процессе")
+    parser.add_argument("--threads", type=int, nargs="+", metavar="N",
+                        help="Замерить также пропускную способность Evaluator из N потоков")
+    parser.add_argument("--output", help="Сохранить отчет в файл JSON")
+    parser.add_argument("--baseline", help="Сравнить с сохраненным отчетом JSON")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Допустимое замедление медианы относительно базового отчета (по умолчанию: 0.2)")
+    args = parser.parse_args(argv)
+
+    profiles = {name: PROFILES[name] for name in args.profile} if args.profile else None
+    report = run_benchmarks(profiles, args.repeat, args.seed)
+    if args.startup:
+        report['results'].update(measure_startup()[0])
+    if args.threads:
+        # Выражения с переменными, чтобы компиляция не свернула их в число
+        variables = {'x': 1.5, 'y': 1.5}
+        for name, profile in (profiles or PROFILES).items():
+            expression = generate_expression(seed=args.seed, variables=tuple(variables), **profile)
+            report['results'].update(measure_threads(name, expression, args.threads, args.repeat * 10, variables))
+
+    print(f"{'Сценарий':32} {'оп/с':>12} {'p50, мкс':>10} {'p90, мкс':>10} {'p99, мкс':>10}")
+    for scenario, stats in report['results'].items():
+        print(f"{scenario:32} {stats['ops_per_s']:12.0f} {stats['p50_ns'] / 1000:10.2f} "
+              f"{stats['p90_ns'] / 1000:10.2f} {stats['p99_ns'] / 1000:10.2f}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            baseline = json.load(file)
+        regressions = compare(report, baseline, args.threshold)
+        for scenario, base, current, ratio in regressions:
+            print(f"Замедление {scenario}: {base / 1000:.2f} -> {current / 1000:.2f} мкс (x{ratio:.2f})",
+                  file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
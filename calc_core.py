@@ -0,0 +1,1786 @@
+# Ядро калькулятора: разбор, вычисление, компиляция и кэши. Модуль не
+# импортирует argparse, json и re при загрузке, поэтому быстро загружается
+# в процессах, которым нужны только вычисления; командная строка - в calc.py
+import ast
+import operator as op
+import math
+import time
+import _thread
+from types import MappingProxyType
+from collections import OrderedDict, namedtuple, deque, Counter
+
+operators = {
+    ast.Add: op.add,
+    ast.Sub: op.sub,
+    ast.Mult: op.mul,
+    ast.Div: op.truediv,
+    ast.USub: op.neg,
+    ast.Pow: op.pow,
+}
+
+functions = {
+    'sqrt': math.sqrt,
+    'sin': math.sin,
+    'cos': math.cos,
+    'tg': math.tan,
+    'ctg': lambda x: 1/math.tan(x),
+    'ln': math.log,
+    'exp': math.exp,
+}
+
+constants = {
+    'pi': math.pi,
+    'e': math.e,
+}
+
+# Встроенные функции: их значение всегда float. Функции, добавленные в
+# functions или в реестр Evaluator, могут вернуть и целое
+_float_functions = dict(functions)
+
+# Функции, аргумент которых задается в единицах angle_unit
+trig_functions = frozenset(['sin', 'cos', 'tg', 'ctg'])
+
+# Ограничения одного вычисления, 0 - без ограничения: число узлов дерева,
+# размер целого числа в битах и время вычисления в секундах
+node_limit = 0
+int_bits_limit = 4096
+time_limit = 0
+# Номер набора ограничений: меняется при каждом изменении ограничений
+limits_version = 0
+
+def configure_limits(max_nodes=None, max_int_bits=None, timeout=None):
+    # Настраиваем ограничения; None оставляет параметр без изменений
+    global node_limit, int_bits_limit, time_limit, limits_version
+    limits = (node_limit, int_bits_limit, time_limit)
+    if max_nodes is not None:
+        node_limit = max_nodes
+    if max_int_bits is not None:
+        int_bits_limit = max_int_bits
+    if timeout is not None:
+        time_limit = timeout
+    if (node_limit, int_bits_limit, time_limit) != limits:
+        # Кэшированные выражения прошли проверку размера при старых
+        # ограничениях, а свернутые при компиляции константы зависят от
+        # ограничения размера целых
+        limits_version += 1
+        cache_clear()
+
+def _power(left, right):
+    # Возведение в степень с оценкой размера целого результата: если он
+    # больше int_bits_limit битов, вычисляем в float, который переполняется
+    # сразу, а не после долгого умножения огромных целых
+    if type(left) is int and type(right) is int and right > 1 and int_bits_limit:
+        if abs(left) > 1 and right * math.log2(abs(left)) > int_bits_limit:
+            return float(left) ** right
+    return left ** right
+
+def _multiply(left, right):
+    if type(left) is int and type(right) is int and int_bits_limit:
+        if left.bit_length() + right.bit_length() > int_bits_limit:
+            return float(left) * float(right)
+    return left * right
+
+# Операторы, которые используются при вычислении: * и ^ над целыми
+# с оценкой размера результата
+_checked_operators = dict(operators)
+_checked_operators[ast.Mult] = _multiply
+_checked_operators[ast.Pow] = _power
+
+def _size_error(nodes):
+    return f"Слишком большое выражение: {nodes} узлов, допустимо {node_limit}"
+
+def _check_size(nodes, prefix="Некорректное выражение: "):
+    # Ошибка размера - ошибка выражения, как при разборе; parse() добавляет
+    # префикс сам
+    if node_limit and nodes > node_limit:
+        raise ValueError(prefix + _size_error(nodes))
+
+def _deadline(items):
+    # Перебираем элементы и каждые 1024 элемента проверяем, не истекло ли
+    # время time_limit
+    deadline = time.monotonic() + time_limit
+    for i, item in enumerate(items):
+        if not i & 1023 and time.monotonic() > deadline:
+            raise TimeoutError("Превышено время вычисления.")
+        yield item
+
+# Метка отсутствующего значения
+_missing = object()
+
+# Узлы дерева выражения. Операция задается классом операции из модуля ast,
+# по которому выбирается функция в operators
+class Number:
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+class Name:
+    __slots__ = ('id',)
+
+    def __init__(self, id):
+        self.id = id
+
+class BinOp:
+    __slots__ = ('op', 'left', 'right')
+
+    def __init__(self, op, left, right):
+        self.op = op
+        self.left = left
+        self.right = right
+
+class UnaryOp:
+    __slots__ = ('op', 'operand')
+
+    def __init__(self, op, operand):
+        self.op = op
+        self.operand = operand
+
+class Call:
+    __slots__ = ('func', 'args')
+
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+
+def from_ast(node):
+    # Преобразуем дерево модуля ast в дерево калькулятора
+    if isinstance(node, ast.Expression):
+        return from_ast(node.body)
+    elif isinstance(node, ast.Constant):
+        return Number(node.value)
+    elif isinstance(node, ast.BinOp):
+        return BinOp(type(node.op), from_ast(node.left), from_ast(node.right))
+    elif isinstance(node, ast.UnaryOp):
+        return UnaryOp(type(node.op), from_ast(node.operand))
+    elif isinstance(node, ast.Name):
+        return Name(node.id)
+    elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and not node.keywords:
+        return Call(node.func.id, [from_ast(arg) for arg in node.args])
+    else:
+        raise TypeError(f"Неверное выражение: неподдерживаемый узел AST {type(node)}")
+
+# Лексемы: число, имя, оператор или любой другой непробельный символ
+class _Pattern:
+    # Регулярное выражение, которое компилируется при первом обращении
+    # и заменяет собой этот объект в модуле: модуль re загружается только
+    # тогда, когда он нужен, а дальше обращение к шаблону ничего не стоит
+    def __init__(self, name, pattern):
+        self.name = name
+        self.pattern = pattern
+
+    def __getattr__(self, attribute):
+        import re
+        compiled = globals()[self.name] = re.compile(self.pattern)
+        return getattr(compiled, attribute)
+
+_token = _Pattern('_token', r'\d+\.?\d*(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?|[a-zA-Z][a-zA-Z0-9]*|\*\*|\S')
+_operator_tokens = frozenset(['+', '-', '*', '/', '^', '**', '(', ')', ','])
+_identifier = _Pattern('_identifier', r'[a-zA-Z][a-zA-Z0-9]*')
+
+# Сила связывания бинарных операторов слева и справа; ^ правоассоциативен
+_binary_operators = {
+    '+': (10, 11, ast.Add),
+    '-': (10, 11, ast.Sub),
+    '*': (20, 21, ast.Mult),
+    '/': (20, 21, ast.Div),
+    '^': (31, 30, ast.Pow),
+    '**': (31, 30, ast.Pow),
+}
+# Унарный минус связывает слабее степени: -2^2 = -(2^2)
+_unary_power = 25
+
+def _tokenize(expression):
+    # Разбиваем выражение на лексемы за один проход. Число хранится как int
+    # или float, имя и оператор - как строка, конец выражения - как None
+    tokens = _token.findall(expression)
+    for i, token in enumerate(tokens):
+        first = token[0]
+        if first.isdigit() or first == '.':
+            if '.' in token or 'e' in token or 'E' in token:
+                tokens[i] = float(token)
+            else:
+                tokens[i] = int(token)
+        elif not first.isalpha() and token not in _operator_tokens:
+            raise ValueError(f"Выражение содержит неверные символы: {token}")
+    tokens.append(None)
+    return tokens
+
+_numbers = (int, float)
+# Лексемы, которые не становятся узлами дерева
+_delimiters = frozenset(['(', ')', ',', None])
+
+# Метка открывающей скобки на стеке операторов: ее не сворачивает ни один оператор
+_PAREN = -1
+
+def _reduce(output, operators_stack, min_power):
+    # Сворачиваем отложенные операторы, связывающие сильнее min_power
+    while operators_stack and operators_stack[-1][0] > min_power:
+        power, operation = operators_stack.pop()
+        if power == _unary_power:
+            output[-1] = UnaryOp(operation, output[-1])
+        else:
+            right = output.pop()
+            output[-1] = BinOp(operation, output[-1], right)
+
+def _parse_tokens(tokens, variables):
+    # Разбор с подъемом по приоритетам без рекурсии: операнды и отложенные
+    # операторы хранятся в явных стеках, поэтому глубина вложенности
+    # ограничена только памятью. Для каждой открытой скобки запоминаем имя
+    # функции (или None) и позицию первого аргумента в стеке операндов
+    output = []
+    operators_stack = []
+    parens = []
+    pos = 0
+    while True:
+        # Ожидаем операнд
+        token = tokens[pos]
+        pos += 1
+        if type(token) in _numbers:
+            output.append(Number(token))
+        elif token is None:
+            raise ValueError("Неполное выражение")
+        elif token[0].isalpha():
+            if token not in functions and token not in constants and token not in variables:
+                raise ValueError(f"Выражение содержит неверные символы: {token}")
+            if tokens[pos] == '(':
+                pos += 1
+                parens.append((token, len(output)))
+                operators_stack.append((_PAREN, None))
+                continue
+            output.append(Name(token))
+        elif token == '-':
+            operators_stack.append((_unary_power, ast.USub))
+            continue
+        elif token == '+':
+            continue
+        elif token == '(':
+            parens.append((None, len(output)))
+            operators_stack.append((_PAREN, None))
+            continue
+        elif token == ')' and not parens:
+            raise ValueError("unmatched ')'")
+        else:
+            raise ValueError("Неполное выражение")
+
+        # Ожидаем оператор, запятую или закрывающую скобку
+        while True:
+            token = tokens[pos]
+            binary = _binary_operators.get(token)
+            if binary is not None:
+                pos += 1
+                left_power, right_power, operation = binary
+                _reduce(output, operators_stack, left_power)
+                operators_stack.append((right_power, operation))
+                break
+            if token == ')':
+                pos += 1
+                if not parens:
+                    raise ValueError("unmatched ')'")
+                _reduce(output, operators_stack, _PAREN)
+                operators_stack.pop()
+                func_name, start = parens.pop()
+                if func_name is not None:
+                    args = output[start:]
+                    del output[start:]
+                    output.append(Call(func_name, args))
+                continue
+            if token == ',' and parens and parens[-1][0] is not None:
+                pos += 1
+                _reduce(output, operators_stack, _PAREN)
+                break
+            if token is None and not parens:
+                _reduce(output, operators_stack, _PAREN)
+                return output[0]
+            if token is None:
+                raise ValueError("'(' was never closed")
+            raise ValueError("Неполное выражение")
+
+def _check_variables(variables):
+    for name in variables:
+        if name in functions or name in constants or not _identifier.fullmatch(name):
+            raise ValueError(f"Недопустимое имя переменной: {name}")
+
+def parse(expression, variables=()):
+    # Преобразуем выражение в дерево, variables - имена допустимых переменных
+    try:
+        _check_variables(variables)
+        tokens = _tokenize(expression)
+        if node_limit:
+            _check_size(sum(token not in _delimiters for token in tokens), '')
+        return _parse_tokens(tokens, variables)
+    except (TypeError, KeyError, ValueError) as e:
+        raise ValueError(f"Некорректное выражение: {e}")
+
+def _syntax_error(expression, variables=()):
+    # Проверка синтаксиса без построения дерева и без исключений: те же
+    # проверки в том же порядке и те же сообщения, что у parse(). Возвращаем
+    # сообщение об ошибке или None
+    for name in variables:
+        if name in functions or name in constants or not _identifier.fullmatch(name):
+            return f"Некорректное выражение: Недопустимое имя переменной: {name}"
+    tokens = _token.findall(expression)
+    for token in tokens:
+        first = token[0]
+        if first.isdigit() or first == '.':
+            if token == '.' or not first.isdecimal():
+                # Редкие лексемы, которые _tokenize() не преобразует в число
+                try:
+                    float(token) if '.' in token or 'e' in token or 'E' in token else int(token)
+                except ValueError as e:
+                    return f"Некорректное выражение: {e}"
+        elif not first.isalpha() and token not in _operator_tokens:
+            return f"Некорректное выражение: Выражение содержит неверные символы: {token}"
+    if node_limit:
+        nodes = sum(token not in _delimiters for token in tokens)
+        if nodes > node_limit:
+            return f"Некорректное выражение: {_size_error(nodes)}"
+
+    # Состояние разбора: ожидается операнд или оператор; для каждой открытой
+    # скобки - признак вызова функции
+    operand = True
+    parens = []
+    n = len(tokens)
+    pos = 0
+    while pos < n:
+        token = tokens[pos]
+        pos += 1
+        first = token[0]
+        if operand:
+            if first.isdigit() or first == '.':
+                operand = False
+            elif first.isalpha():
+                if token not in functions and token not in constants and token not in variables:
+                    return f"Некорректное выражение: Выражение содержит неверные символы: {token}"
+                if pos < n and tokens[pos] == '(':
+                    pos += 1
+                    parens.append(True)
+                else:
+                    operand = False
+            elif token == '(':
+                parens.append(False)
+            elif token == ')' and not parens:
+                return "Некорректное выражение: unmatched ')'"
+            elif token != '-' and token != '+':
+                return "Некорректное выражение: Неполное выражение"
+        elif token in _binary_operators:
+            operand = True
+        elif token == ')':
+            if not parens:
+                return "Некорректное выражение: unmatched ')'"
+            parens.pop()
+        elif token == ',' and parens and parens[-1]:
+            operand = True
+        else:
+            return "Некорректное выражение: Неполное выражение"
+    if operand:
+        return "Некорректное выражение: Неполное выражение"
+    if parens:
+        return "Некорректное выражение: '(' was never closed"
+    return None
+
+def _to_tree(expression, variables=()):
+    # Строку разбираем, дерево модуля ast преобразуем, готовое дерево оставляем
+    if isinstance(expression, str):
+        return parse(expression, variables)
+    if isinstance(expression, ast.AST):
+        return from_ast(expression)
+    return expression
+
+def postorder(tree):
+    # Список узлов дерева в обратной польской записи: операнды раньше операции.
+    # Обход без рекурсии, поэтому глубина дерева ограничена только памятью
+    order = []
+    pending = [tree]
+    while pending:
+        node = pending.pop()
+        order.append(node)
+        if isinstance(node, BinOp):
+            pending.append(node.left)
+            pending.append(node.right)
+        elif isinstance(node, UnaryOp):
+            pending.append(node.operand)
+        elif isinstance(node, Call):
+            pending.extend(node.args)
+    order.reverse()
+    return order
+
+def depth(tree):
+    # Глубина дерева, посчитанная без рекурсии
+    stack = []
+    for node in postorder(tree):
+        if isinstance(node, BinOp):
+            right = stack.pop()
+            stack[-1] = max(stack[-1], right) + 1
+        elif isinstance(node, UnaryOp):
+            stack[-1] += 1
+        elif isinstance(node, Call) and node.args:
+            n = len(node.args)
+            value = max(stack[-n:]) + 1
+            del stack[-n:]
+            stack.append(value)
+        else:
+            stack.append(1)
+    return stack[0]
+
+def evaluate(node, angle_unit='radian', variables=None):
+    # Вычисляем значение выражения, представленного в виде дерева. Узлы
+    # обходятся в обратной польской записи, промежуточные значения хранятся
+    # в явном стеке
+    if isinstance(node, ast.AST):
+        node = from_ast(node)
+    return _walk(postorder(node), angle_unit, variables, functions)
+
+def _walk(order, angle_unit, variables, table):
+    # Вычисление по списку узлов в обратной польской записи; table - таблица
+    # функций (при профилировании функции обернуты замером времени)
+    if node_limit:
+        _check_size(len(order))
+    if time_limit:
+        order = _deadline(order)
+    stack = []
+    for node in order:
+        if isinstance(node, Number):
+            stack.append(node.value)
+        elif isinstance(node, BinOp):
+            right = stack.pop()
+            stack[-1] = _checked_operators[node.op](stack[-1], right)
+        elif isinstance(node, UnaryOp):
+            stack[-1] = operators[node.op](stack[-1])
+        elif isinstance(node, Name):
+            if node.id in constants:
+                stack.append(constants[node.id])
+            elif variables is not None and node.id in variables:
+                stack.append(variables[node.id])
+            else:
+                raise ValueError(f"Неизвестная константа: {node.id}")
+        elif isinstance(node, Call):
+            func_name = node.func
+            if func_name not in functions:
+                raise ValueError(f"Неизвестная функция: {func_name}")
+
+            n = len(node.args)
+            if n != 1:
+                raise ValueError(f"Функция {func_name} принимает ровно 1 аргумент")
+
+            value = stack[-1]
+            if func_name in trig_functions and angle_unit == 'degree':
+                value = math.radians(value)
+
+            try:
+                stack[-1] = table[func_name](value)
+            except ValueError as e:
+                raise ValueError(f"Ошибка в функции {func_name}: {e}")
+        else:
+            raise TypeError(f"Неверное выражение: неподдерживаемый узел AST {type(node)}")
+    return stack[0]
+
+def calculate(expression, angle_unit='radian', variables=None):
+    if profiler is not None:
+        return _calculate_profiled(profiler, expression, angle_unit, variables)
+    if cache_enabled and isinstance(expression, str):
+        return _calculate_cached(expression, angle_unit, variables)
+    try:
+        # Если выражение является строкой, парсим его в дерево
+        tree = _to_tree(expression, variables or ())
+        result = evaluate(tree, angle_unit, variables)
+        if math.isinf(result) or math.isnan(result):
+            raise OverflowError("Арифметическое переполнение.")
+        return result
+    except (SyntaxError, TypeError, KeyError) as e:
+        raise ValueError(f"Некорректное выражение: {e}")
+    except ZeroDivisionError:
+        raise ZeroDivisionError("Деление на ноль.")
+    except OverflowError:
+        raise OverflowError("Арифметическое переполнение.")
+
+# Коды результата try_calculate() и validate()
+OK, INVALID, ERROR, ZERO_DIVISION, OVERFLOW, TIMEOUT = range(6)
+
+class Result(namedtuple('Result', ['status', 'value', 'message'])):
+    # Результат try_calculate(): код, значение (None при ошибке) и сообщение
+    # об ошибке (None при успехе) с тем же текстом, что у исключения calculate()
+    __slots__ = ()
+
+    @property
+    def ok(self):
+        return self.status == OK
+
+_valid = Result(OK, None, None)
+
+def validate(expression, variables=()):
+    # Проверка синтаксиса выражения без вычисления и без построения дерева.
+    # Result со статусом OK или INVALID и сообщением, как у parse()
+    message = _syntax_error(expression, variables)
+    return _valid if message is None else Result(INVALID, None, message)
+
+def _attempt(func, *args):
+    # Вычисление, ошибка которого сразу становится Result с сообщением
+    # calculate(), без повторного возбуждения исключения
+    try:
+        value = func(*args)
+        if math.isinf(value) or math.isnan(value):
+            return Result(OVERFLOW, None, "Арифметическое переполнение.")
+        return Result(OK, value, None)
+    except ZeroDivisionError:
+        return Result(ZERO_DIVISION, None, "Деление на ноль.")
+    except OverflowError:
+        return Result(OVERFLOW, None, "Арифметическое переполнение.")
+    except TimeoutError as e:
+        return Result(TIMEOUT, None, str(e))
+    except (SyntaxError, TypeError, KeyError) as e:
+        return Result(INVALID, None, f"Некорректное выражение: {e}")
+    except ValueError as e:
+        message = str(e)
+        return Result(INVALID if message.startswith("Некорректное выражение") else ERROR, None, message)
+
+def try_calculate(expression, angle_unit='radian', variables=None):
+    # calculate() без исключений для потоков, в которых много ошибочных
+    # выражений: ошибка возвращается в Result с тем же сообщением.
+    # Синтаксические ошибки находит validate() до разбора, а ошибки
+    # вычисления перехватываются один раз. Кэш попыток хранит по исходному
+    # тексту дерево, скомпилированную функцию или Result синтаксической
+    # ошибки, поэтому повторная ошибка стоит столько же, сколько повторный успех
+    if not (cache_enabled and profiler is None and isinstance(expression, str)):
+        if isinstance(expression, str):
+            message = _syntax_error(expression, variables or ())
+            if message is not None:
+                return Result(INVALID, None, message)
+        return _attempt(calculate, expression, angle_unit, variables)
+
+    names = tuple(sorted(variables)) if variables else ()
+    key = (expression, angle_unit, names)
+    entry = attempt_cache.get(key)
+    if entry is None:
+        message = _syntax_error(expression, names)
+        if message is not None:
+            entry = Result(INVALID, None, message)
+            attempt_cache.put(key, entry)
+            return entry
+        try:
+            tree = parse(expression, names)
+        except ValueError as e:
+            return Result(INVALID, None, str(e))
+        attempt_cache.put(key, tree)
+        return _attempt(evaluate, tree, angle_unit, variables)
+    if type(entry) is Result:
+        return entry
+    if not callable(entry):
+        try:
+            entry = compile_expression(entry, angle_unit, names).__wrapped__
+        except ValueError:
+            # Ошибку компиляции сообщает обход дерева, как при первом вычислении
+            return _attempt(evaluate, entry, angle_unit, variables)
+        attempt_cache.put(key, entry)
+    if names:
+        return _attempt(entry, *[variables[name] for name in names])
+    return _attempt(entry)
+
+def _resolve_function(func_name, angle_unit):
+    # Заранее разрешаем функцию: перевод градусов и обертка ошибок области определения
+    return _wrap_function(func_name, functions[func_name], func_name in trig_functions and angle_unit == 'degree')
+
+def _wrap_function(func_name, func, degrees):
+    if degrees:
+        radians = math.radians
+        def call(value):
+            try:
+                return func(radians(value))
+            except ValueError as e:
+                raise ValueError(f"Ошибка в функции {func_name}: {e}")
+    else:
+        def call(value):
+            try:
+                return func(value)
+            except ValueError as e:
+                raise ValueError(f"Ошибка в функции {func_name}: {e}")
+    return call
+
+def _arguments(n):
+    # Число аргументов словами: 1 аргумент, 2 аргумента, 5 аргументов
+    if n % 10 == 1 and n % 100 != 11:
+        return f"{n} аргумент"
+    if 2 <= n % 10 <= 4 and not 12 <= n % 100 <= 14:
+        return f"{n} аргумента"
+    return f"{n} аргументов"
+
+class _ModuleRegistry:
+    # Константы и функции модуля для компиляции: читаются из constants и
+    # functions при каждой компиляции, поэтому изменения этих словарей
+    # учитываются. У Evaluator свой, неизменяемый реестр с тем же интерфейсом
+    __slots__ = ('angle_unit',)
+
+    def __init__(self, angle_unit):
+        self.angle_unit = angle_unit
+
+    @property
+    def constants(self):
+        return constants
+
+    def floating(self, func_name):
+        # Всегда ли значение функции - float
+        func = functions.get(func_name)
+        return func is not None and func is _float_functions.get(func_name)
+
+    def function(self, func_name, n):
+        # Разрешенная функция для вызова с n аргументами
+        if func_name not in functions:
+            raise ValueError(f"Неизвестная функция: {func_name}")
+        if n != 1:
+            raise ValueError(f"Функция {func_name} принимает ровно 1 аргумент")
+        return _resolve_function(func_name, self.angle_unit)
+
+def _fold(func, *args):
+    # Значение операции над константами или _missing, если при вычислении
+    # возникает ошибка: такое поддерево остается, чтобы ошибка возникла
+    # при вычислении выражения
+    try:
+        value = func(*args)
+    except (ArithmeticError, ValueError, TypeError):
+        return _missing
+    return value if type(value) in _numbers else _missing
+
+def _is_int(node, value):
+    return isinstance(node, Number) and type(node.value) is int and node.value == value
+
+def _simplify_binary(operation, left, right):
+    if isinstance(left, Number) and isinstance(right, Number) and operation in _checked_operators:
+        value = _fold(_checked_operators[operation], left.value, right.value)
+        if value is not _missing:
+            return Number(value)
+    # Тождества применяются только к целым 0 и 1, чтобы не менять тип результата
+    if operation is ast.Add and _is_int(right, 0) or operation is ast.Sub and _is_int(right, 0):
+        return left
+    if operation is ast.Add and _is_int(left, 0):
+        return right
+    if operation is ast.Mult and _is_int(right, 1) or operation is ast.Pow and _is_int(right, 1):
+        return left
+    if operation is ast.Mult and _is_int(left, 1):
+        return right
+    return BinOp(operation, left, right)
+
+def _simplify_call(func_name, args, registry):
+    if args and all(isinstance(arg, Number) for arg in args):
+        try:
+            func = registry.function(func_name, len(args))
+        except ValueError:
+            # Неизвестная функция остается, ошибка возникнет при компиляции
+            return Call(func_name, args)
+        value = _fold(func, *[arg.value for arg in args])
+        if value is not _missing:
+            return Number(value)
+    return Call(func_name, args)
+
+def _intern(node, canonical):
+    # Одинаковые поддеревья заменяем одним узлом
+    if isinstance(node, Number):
+        value = node.value
+        key = (type(value), value, math.copysign(1, value) if type(value) is float else 0)
+    elif isinstance(node, Name):
+        key = node.id
+    elif isinstance(node, BinOp):
+        key = (node.op, id(node.left), id(node.right))
+    elif isinstance(node, UnaryOp):
+        key = (node.op, id(node.operand))
+    elif isinstance(node, Call):
+        key = (node.func,) + tuple(id(arg) for arg in node.args)
+    else:
+        return node
+    return canonical.setdefault(key, node)
+
+def optimize(tree, angle_unit='radian'):
+    # Упрощаем дерево перед компиляцией: сворачиваем поддеревья из чисел
+    # и констант, убираем тождественные операции x*1, x+0, x-0, x^1 и
+    # объединяем одинаковые поддеревья, чтобы они вычислялись один раз.
+    # Результат - граф, в котором общий узел может иметь несколько родителей
+    return _optimize(tree, _ModuleRegistry(angle_unit))
+
+def _optimize(tree, registry):
+    constants = registry.constants
+    canonical = {}
+    stack = []
+    for node in postorder(tree):
+        if isinstance(node, Name) and node.id in constants:
+            node = Number(constants[node.id])
+        elif isinstance(node, BinOp):
+            right = stack.pop()
+            node = _simplify_binary(node.op, stack.pop(), right)
+        elif isinstance(node, UnaryOp):
+            operand = stack.pop()
+            value = _fold(operators[node.op], operand.value) if isinstance(operand, Number) and node.op in operators else _missing
+            node = Number(value) if value is not _missing else UnaryOp(node.op, operand)
+        elif isinstance(node, Call):
+            n = len(node.args)
+            args = stack[len(stack) - n:]
+            del stack[len(stack) - n:]
+            node = _simplify_call(node.func, args, registry)
+        stack.append(_intern(node, canonical))
+    return stack[0]
+
+def _shared(tree):
+    # Операции, на которые в графе ссылаются несколько раз, с номерами ячеек
+    # для сохраненных значений
+    counts = {}
+    pending = [tree]
+    while pending:
+        node = pending.pop()
+        if node in counts:
+            counts[node] += 1
+            continue
+        counts[node] = 1
+        if isinstance(node, BinOp):
+            pending.append(node.left)
+            pending.append(node.right)
+        elif isinstance(node, UnaryOp):
+            pending.append(node.operand)
+        elif isinstance(node, Call):
+            pending.extend(node.args)
+    shared = [node for node, count in counts.items() if count > 1 and isinstance(node, (BinOp, UnaryOp, Call))]
+    return {node: slot for slot, node in enumerate(shared)}
+
+def _integral(tree, shared, registry):
+    # Узлы, значение которых может оказаться целым: переменные, целые числа,
+    # вызовы функций, кроме встроенных, и операции над ними, кроме деления.
+    # Только для таких узлов * и ^ компилируются с оценкой размера результата
+    constants = registry.constants
+    integral = set()
+    for node, reused in _schedule(tree, shared):
+        if reused:
+            continue
+        if isinstance(node, Number):
+            maybe = type(node.value) is int
+        elif isinstance(node, Name):
+            maybe = node.id not in constants
+        elif isinstance(node, BinOp):
+            maybe = node.op is not ast.Div and node.left in integral and node.right in integral
+        elif isinstance(node, UnaryOp):
+            maybe = node.operand in integral
+        elif isinstance(node, Call):
+            maybe = not registry.floating(node.func)
+        else:
+            maybe = False
+        if maybe:
+            integral.add(node)
+    return integral
+
+# Операции над целыми, которые выполняются с оценкой размера результата
+_guarded = {ast.Mult: '__mul', ast.Pow: '__pow'}
+
+def _lower(node, registry, namespace, variables, shared, integral, emitted):
+    # Переводим дерево калькулятора в дерево Python, в котором константы
+    # подставлены, переменные стали аргументами, а функции заменены
+    # на заранее разрешенные вызовы. Общий узел вычисляется при первом
+    # появлении и сохраняется в переменной
+    if node in shared:
+        name = f"__t{shared[node]}"
+        if node in emitted:
+            return ast.Name(id=name, ctx=ast.Load())
+        emitted.add(node)
+        value = _lower(node, registry, namespace, variables, {}, integral, emitted)
+        return ast.NamedExpr(target=ast.Name(id=name, ctx=ast.Store()), value=value)
+    if isinstance(node, Number):
+        return ast.Constant(value=node.value)
+    elif isinstance(node, BinOp):
+        operators[node.op]
+        left = _lower(node.left, registry, namespace, variables, shared, integral, emitted)
+        right = _lower(node.right, registry, namespace, variables, shared, integral, emitted)
+        if node.op in _guarded and node.left in integral and node.right in integral:
+            name = _guarded[node.op]
+            namespace[name] = _checked_operators[node.op]
+            return ast.Call(func=ast.Name(id=name, ctx=ast.Load()), args=[left, right], keywords=[])
+        return ast.BinOp(left=left, op=node.op(), right=right)
+    elif isinstance(node, UnaryOp):
+        operators[node.op]
+        operand = _lower(node.operand, registry, namespace, variables, shared, integral, emitted)
+        return ast.UnaryOp(op=node.op(), operand=operand)
+    elif isinstance(node, Name):
+        if node.id in registry.constants:
+            return ast.Constant(value=registry.constants[node.id])
+        if node.id in variables:
+            return ast.Name(id=f"__v{variables.index(node.id)}", ctx=ast.Load())
+        raise ValueError(f"Неизвестная константа: {node.id}")
+    elif isinstance(node, Call):
+        # У функций свой префикс: имя функции не совпадет ни с параметром,
+        # ни с общим узлом, ни с проверяемым оператором
+        # Аргументы раньше функции: ошибки те же и в том же порядке, что при
+        # обходе дерева
+        args = [_lower(arg, registry, namespace, variables, shared, integral, emitted) for arg in node.args]
+        name = f"__f_{node.func}"
+        namespace[name] = registry.function(node.func, len(node.args))
+        return ast.Call(func=ast.Name(id=name, ctx=ast.Load()), args=args, keywords=[])
+    else:
+        raise TypeError(f"Неверное выражение: неподдерживаемый узел AST {type(node)}")
+
+def _bytecode(tree, registry, variables):
+    # Компилируем дерево в функцию Python
+    namespace = {'__builtins__': {}}
+    shared = _shared(tree)
+    body = _lower(tree, registry, namespace, variables, shared, _integral(tree, shared, registry), set())
+    params = [ast.arg(arg=f"__v{i}") for i in range(len(variables))]
+    arguments = ast.arguments(posonlyargs=params, args=[], kwonlyargs=[], kw_defaults=[], defaults=[])
+    code = ast.Expression(body=ast.Lambda(args=arguments, body=body))
+    return eval(compile(ast.fix_missing_locations(code), '<calc>', 'eval'), namespace)
+
+# Команды программы в обратной польской записи; _CALL - вызов функции
+# с числом аргументов, отличным от одного
+_PUSH, _LOAD, _APPLY, _BINARY, _STORE, _RECALL, _CALL = range(7)
+
+def _schedule(tree, shared):
+    # Порядок выполнения узлов графа: операнды раньше операции, общий узел
+    # вычисляется один раз, а затем берется из ячейки. Элемент - пара
+    # (узел, повторное использование)
+    order = []
+    emitted = set()
+    pending = [(tree, False)]
+    while pending:
+        node, expanded = pending.pop()
+        if expanded:
+            order.append((node, False))
+            if node in shared:
+                emitted.add(node)
+        elif node in emitted:
+            order.append((node, True))
+        else:
+            pending.append((node, True))
+            if isinstance(node, BinOp):
+                pending.append((node.right, False))
+                pending.append((node.left, False))
+            elif isinstance(node, UnaryOp):
+                pending.append((node.operand, False))
+            elif isinstance(node, Call):
+                pending.extend((arg, False) for arg in reversed(node.args))
+    return order
+
+def _assemble(tree, variables, registry=None):
+    # Переводим дерево в программу в обратной польской записи. Аргументы
+    # команд символьные: число, номер переменной или ячейки, класс оператора
+    # (для _BINARY - пара класс и признак проверки размера целых), имя
+    # функции (для _CALL - пара имя и число аргументов). Такую программу
+    # можно сохранить, а перед выполнением ее разрешает _link()
+    registry = registry or _ModuleRegistry('radian')
+    constants = registry.constants
+    program = []
+    shared = _shared(tree)
+    integral = _integral(tree, shared, registry)
+    for node, reused in _schedule(tree, shared):
+        if reused:
+            program.append((_RECALL, shared[node]))
+            continue
+        if isinstance(node, Number):
+            program.append((_PUSH, node.value))
+        elif isinstance(node, BinOp):
+            operators[node.op]
+            guarded = node.op in _guarded and node.left in integral and node.right in integral
+            program.append((_BINARY, (node.op, guarded)))
+        elif isinstance(node, UnaryOp):
+            operators[node.op]
+            program.append((_APPLY, node.op))
+        elif isinstance(node, Name):
+            if node.id in constants:
+                program.append((_PUSH, constants[node.id]))
+            elif node.id in variables:
+                program.append((_LOAD, variables.index(node.id)))
+            else:
+                raise ValueError(f"Неизвестная константа: {node.id}")
+        elif isinstance(node, Call):
+            n = len(node.args)
+            registry.function(node.func, n)
+            program.append((_APPLY, node.func) if n == 1 else (_CALL, (node.func, n)))
+        else:
+            raise TypeError(f"Неверное выражение: неподдерживаемый узел AST {type(node)}")
+        if node in shared:
+            program.append((_STORE, shared[node]))
+    return program
+
+def _link(program, registry):
+    # Заменяем символьные аргументы команд операторами и заранее
+    # разрешенными функциями реестра
+    linked = []
+    resolved = {}
+    for code, arg in program:
+        if code == _BINARY:
+            operation, guarded = arg
+            arg = _checked_operators[operation] if guarded else operators[operation]
+        elif code == _APPLY:
+            if type(arg) is str:
+                if arg not in resolved:
+                    resolved[arg] = registry.function(arg, 1)
+                arg = resolved[arg]
+            else:
+                arg = operators[arg]
+        elif code == _CALL:
+            func_name, n = arg
+            arg = (registry.function(func_name, n), n)
+        linked.append((code, arg))
+    return linked
+
+def _interpreter(program):
+    # Функция, выполняющая программу на явном стеке значений
+    slots = sum(1 for code, _ in program if code == _STORE)
+
+    def run(*values):
+        stack = []
+        saved = [None] * slots
+        push = stack.append
+        pop = stack.pop
+        for code, arg in (_deadline(program) if time_limit else program):
+            if code == _PUSH:
+                push(arg)
+            elif code == _BINARY:
+                right = pop()
+                stack[-1] = arg(stack[-1], right)
+            elif code == _APPLY:
+                stack[-1] = arg(stack[-1])
+            elif code == _LOAD:
+                push(values[arg])
+            elif code == _STORE:
+                saved[arg] = stack[-1]
+            elif code == _RECALL:
+                push(saved[arg])
+            else:
+                func, n = arg
+                args = stack[-n:]
+                del stack[-n:]
+                push(func(*args))
+        return stack[0]
+    return run
+
+# Компилятор Python рекурсивен, поэтому более глубокие деревья выполняются
+# как программа в обратной польской записи
+_max_bytecode_depth = 200
+
+def compile_expression(expression, angle_unit='radian', variables=()):
+    # Компилируем выражение один раз и возвращаем функцию, которая вычисляет
+    # его так же, как calculate(). Дерево упрощается optimize(), затем
+    # неглубокие деревья компилируются в байткод Python, глубокие - в
+    # программу в обратной польской записи. Значения переменных передаются
+    # позиционно в порядке variables
+    variables = tuple(variables)
+    try:
+        tree = _to_tree(expression, variables)
+        if node_limit and not isinstance(expression, str):
+            _check_size(len(postorder(tree)))
+        return _compile(tree, _ModuleRegistry(angle_unit), variables)
+    except (SyntaxError, TypeError, KeyError) as e:
+        raise ValueError(f"Некорректное выражение: {e}")
+
+def _compile(tree, registry, variables):
+    if time_limit:
+        # С ограничением времени - программа, которая проверяет его по ходу
+        # выполнения. Байткод времени не проверяет, а свертка констант
+        # выполняла бы вычисление при компиляции, тоже без проверки
+        return _checked(_interpreter(_link(_assemble(tree, variables, registry), registry)))
+    tree = _optimize(tree, registry)
+    if depth(tree) <= _max_bytecode_depth:
+        func = _bytecode(tree, registry, variables)
+    else:
+        func = _interpreter(_link(_assemble(tree, variables, registry), registry))
+    return _checked(func)
+
+def _checked(func):
+    # Обертка скомпилированной функции: проверка результата и перевод
+    # исключений в сообщения calculate()
+    isinf = math.isinf
+    isnan = math.isnan
+
+    def compiled(*values):
+        try:
+            result = func(*values)
+            if isinf(result) or isnan(result):
+                raise OverflowError("Арифметическое переполнение.")
+            return result
+        except (SyntaxError, TypeError, KeyError) as e:
+            raise ValueError(f"Некорректное выражение: {e}")
+        except ZeroDivisionError:
+            raise ZeroDivisionError("Деление на ноль.")
+        except OverflowError:
+            raise OverflowError("Арифметическое переполнение.")
+
+    compiled.__wrapped__ = func
+    return compiled
+
+# Функция реестра Evaluator: вызываемый объект, число аргументов и признак
+# того, что аргументы - углы в единицах angle_unit
+Function = namedtuple('Function', ['func', 'arity', 'angular'])
+
+def _function_entry(func_name, entry):
+    # Функция реестра из Function, пары (функция, число аргументов) или функции
+    if isinstance(entry, Function):
+        func, arity, angular = entry
+    elif isinstance(entry, tuple):
+        func, arity, angular = (*entry, False) if len(entry) == 2 else entry
+    else:
+        func, arity, angular = entry, 1, False
+    if not callable(func):
+        raise ValueError(f"Функция {func_name} должна быть вызываемым объектом")
+    if type(arity) is not int or arity < 1:
+        raise ValueError(f"Число аргументов функции {func_name} должно быть положительным целым")
+    return Function(func, arity, bool(angular))
+
+def _resolve_entry(func_name, entry, angle_unit):
+    # Заранее разрешаем функцию реестра: перевод градусов и обертка ошибок
+    # области определения, как у функций модуля
+    func = entry.func
+    degrees = entry.angular and angle_unit == 'degree'
+    if entry.arity == 1:
+        return _wrap_function(func_name, func, degrees)
+    radians = math.radians if degrees else None
+
+    def call(*args):
+        try:
+            return func(*map(radians, args)) if radians else func(*args)
+        except ValueError as e:
+            raise ValueError(f"Ошибка в функции {func_name}: {e}")
+    return call
+
+def _default_functions():
+    return {name: Function(func, 1, name in trig_functions) for name, func in functions.items()}
+
+class Evaluator:
+    # Вычислитель с собственным неизменяемым реестром: операторы, функции
+    # с числом аргументов, константы и единицы измерения углов. Функции
+    # разрешаются один раз при создании (перевод градусов, сообщения об
+    # ошибках); with_function(), with_constant() и with_angle_unit()
+    # возвращают новый вычислитель, не меняя этот. По умолчанию реестр -
+    # копия functions и constants модуля на момент создания.
+    # Вычисления из нескольких потоков не берут блокировок: реестр только
+    # читается, а кэш выражений - словарь, который при заполнении заменяется
+    # новым. Как и calculate(), впервые встреченное выражение вычисляется
+    # обходом дерева, а повторное - скомпилированной функцией
+    __slots__ = ('_angle_unit', '_functions', '_constants', '_operators', '_resolved', '_names',
+                 '_cache', '_cache_size', '_limits')
+
+    def __init__(self, angle_unit='radian', functions=None, constants=None, cache_size=256):
+        if angle_unit not in ('radian', 'degree'):
+            raise ValueError(f"Неизвестные единицы измерения углов: {angle_unit}")
+        functions = _default_functions() if functions is None else functions
+        constants = globals()['constants'] if constants is None else constants
+        functions = {name: _function_entry(name, entry) for name, entry in functions.items()}
+        constants = dict(constants)
+        for name in (*functions, *constants):
+            if not _identifier.fullmatch(name):
+                raise ValueError(f"Недопустимое имя: {name}")
+        for name in functions:
+            if name in constants:
+                raise ValueError(f"Имя {name} задано и как функция, и как константа")
+        self._angle_unit = angle_unit
+        self._functions = MappingProxyType(functions)
+        self._constants = MappingProxyType(constants)
+        self._operators = MappingProxyType(dict(_checked_operators))
+        self._resolved = {name: (_resolve_entry(name, entry, angle_unit), entry.arity)
+                          for name, entry in functions.items()}
+        self._names = frozenset(functions) | frozenset(constants)
+        self._cache = {}
+        self._cache_size = cache_size
+        self._limits = limits_version
+
+    @property
+    def angle_unit(self):
+        return self._angle_unit
+
+    @property
+    def functions(self):
+        return self._functions
+
+    @property
+    def constants(self):
+        return self._constants
+
+    @property
+    def operators(self):
+        return self._operators
+
+    def with_function(self, name, func, arity=1, angular=False):
+        # Новый вычислитель с добавленной или замененной функцией
+        functions = dict(self._functions)
+        functions[name] = Function(func, arity, angular)
+        return Evaluator(self._angle_unit, functions, self._constants, self._cache_size)
+
+    def with_constant(self, name, value):
+        constants = dict(self._constants)
+        constants[name] = value
+        return Evaluator(self._angle_unit, self._functions, constants, self._cache_size)
+
+    def with_angle_unit(self, angle_unit):
+        return Evaluator(angle_unit, self._functions, self._constants, self._cache_size)
+
+    def floating(self, func_name):
+        # Всегда ли значение функции - float (интерфейс реестра, как у
+        # _ModuleRegistry): только у встроенных функций
+        entry = self._functions.get(func_name)
+        return entry is not None and entry.func is _float_functions.get(func_name)
+
+    def function(self, func_name, n):
+        # Разрешенная функция для вызова с n аргументами (интерфейс реестра
+        # для компиляции, как у _ModuleRegistry)
+        resolved = self._resolved.get(func_name)
+        if resolved is None:
+            raise ValueError(f"Неизвестная функция: {func_name}")
+        if resolved[1] != n:
+            raise ValueError(f"Функция {func_name} принимает ровно {_arguments(resolved[1])}")
+        return resolved[0]
+
+    def _check_variables(self, variables):
+        for name in variables:
+            if name in self._names or not _identifier.fullmatch(name):
+                raise ValueError(f"Недопустимое имя переменной: {name}")
+
+    def parse(self, expression, variables=()):
+        try:
+            self._check_variables(variables)
+            tokens = _tokenize(expression)
+            if node_limit:
+                _check_size(sum(token not in _delimiters for token in tokens), '')
+            return _parse_tokens(tokens, self._names.union(variables))
+        except (TypeError, KeyError, ValueError) as e:
+            raise ValueError(f"Некорректное выражение: {e}")
+
+    def _tree(self, expression, variables):
+        if isinstance(expression, str):
+            return self.parse(expression, variables)
+        if isinstance(expression, ast.AST):
+            return from_ast(expression)
+        return expression
+
+    def evaluate(self, tree, variables=None):
+        # Обход дерева в обратной польской записи, как evaluate(), с функциями
+        # и константами реестра
+        order = postorder(self._tree(tree, tuple(variables or ())))
+        if node_limit:
+            _check_size(len(order))
+        if time_limit:
+            order = _deadline(order)
+        operators = self._operators
+        constants = self._constants
+        resolved = self._resolved
+        stack = []
+        for node in order:
+            if isinstance(node, Number):
+                stack.append(node.value)
+            elif isinstance(node, BinOp):
+                right = stack.pop()
+                stack[-1] = operators[node.op](stack[-1], right)
+            elif isinstance(node, UnaryOp):
+                stack[-1] = operators[node.op](stack[-1])
+            elif isinstance(node, Name):
+                if node.id in constants:
+                    stack.append(constants[node.id])
+                elif variables is not None and node.id in variables:
+                    stack.append(variables[node.id])
+                else:
+                    raise ValueError(f"Неизвестная константа: {node.id}")
+            elif isinstance(node, Call):
+                call = self.function(node.func, len(node.args))
+                n = len(node.args)
+                if n == 1:
+                    stack[-1] = call(stack[-1])
+                else:
+                    args = stack[-n:]
+                    del stack[-n:]
+                    stack.append(call(*args))
+            else:
+                raise TypeError(f"Неверное выражение: неподдерживаемый узел AST {type(node)}")
+        return stack[0]
+
+    def compile(self, expression, variables=()):
+        # Как compile_expression(), с реестром этого вычислителя
+        variables = tuple(variables)
+        try:
+            tree = self._tree(expression, variables)
+            if node_limit and not isinstance(expression, str):
+                _check_size(len(postorder(tree)))
+            return _compile(tree, self, variables)
+        except (SyntaxError, TypeError, KeyError) as e:
+            raise ValueError(f"Некорректное выражение: {e}")
+
+    def _store(self, key, value):
+        cache = self._cache
+        if len(cache) >= self._cache_size:
+            # Новый словарь вместо вытеснения: заменить ссылку можно без блокировки
+            cache = self._cache = {}
+        cache[key] = value
+
+    def calculate(self, expression, variables=None):
+        # Как calculate(): те же ошибки и сообщения. Ключ кэша - текст
+        # выражения без нормализации
+        if isinstance(expression, str) and self._cache_size > 0:
+            if self._limits != limits_version:
+                # Ограничения изменились: кэш собран при старых
+                self._cache = {}
+                self._limits = limits_version
+            names = tuple(sorted(variables)) if variables else ()
+            key = (expression, names)
+            entry = self._cache.get(key)
+            if entry is None:
+                expression = self.parse(expression, names)
+                self._store(key, expression)
+            else:
+                if not callable(entry):
+                    entry = self.compile(entry, names)
+                    self._store(key, entry)
+                return entry(*[variables[name] for name in names])
+        try:
+            result = self.evaluate(self._tree(expression, tuple(variables or ())), variables)
+            if math.isinf(result) or math.isnan(result):
+                raise OverflowError("Арифметическое переполнение.")
+            return result
+        except (SyntaxError, TypeError, KeyError) as e:
+            raise ValueError(f"Некорректное выражение: {e}")
+        except ZeroDivisionError:
+            raise ZeroDivisionError("Деление на ноль.")
+        except OverflowError:
+            raise OverflowError("Арифметическое переполнение.")
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'evictions', 'size', 'maxsize'])
+
+class LRUCache:
+    # Ограниченный по размеру кэш, вытесняющий давно не использованные записи.
+    # maxsize = 0 отключает кэш
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = _thread.allocate_lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            if self.maxsize <= 0:
+                return
+            self._data[key] = value
+            self._data.move_to_end(key)
+            self._evict()
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = maxsize
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def info(self):
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, self.evictions, len(self._data), self.maxsize)
+
+    def _evict(self):
+        while len(self._data) > max(self.maxsize, 0):
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+# Кэш скомпилированных выражений по нормализованному тексту и кэш результатов
+# выражений без переменных. Кэш результатов по умолчанию выключен
+expression_cache = LRUCache(256)
+result_cache = LRUCache(0)
+# Кэш try_calculate() по исходному тексту, того же размера, что кэш выражений
+attempt_cache = LRUCache(256)
+# Нормализованный текст по исходному, того же размера
+normalized_texts = LRUCache(256)
+cache_enabled = True
+
+def configure_cache(maxsize=None, result_maxsize=None, enabled=None):
+    # Настраиваем кэши во время работы; None оставляет параметр без изменений
+    global cache_enabled
+    if maxsize is not None:
+        expression_cache.resize(maxsize)
+        attempt_cache.resize(maxsize)
+        normalized_texts.resize(maxsize)
+    if result_maxsize is not None:
+        result_cache.resize(result_maxsize)
+    if enabled is not None:
+        cache_enabled = enabled
+
+def cache_info():
+    return {'expressions': expression_cache.info(), 'results': result_cache.info(),
+            'attempts': attempt_cache.info()}
+
+def cache_clear():
+    expression_cache.clear()
+    result_cache.clear()
+    attempt_cache.clear()
+    normalized_texts.clear()
+
+_whitespace = _Pattern('_whitespace', r'\s+')
+
+def _keep_separator(match):
+    # Пробел нужен только там, где без него изменятся лексемы: между двумя
+    # числами или именами, между двумя *, и вокруг знака, который иначе
+    # стал бы показателем степени числа ("1e -5", "1e- 5")
+    text = match.string
+    start = match.start()
+    before = text[start - 1:start]
+    after = text[match.end():match.end() + 1]
+    if not before or not after:
+        return ''
+    if before == after == '*' or before in 'eE' and after in '+-':
+        return ' '
+    if (before.isalnum() or before in '._') and (after.isalnum() or after in '._'):
+        return ' '
+    if before in '+-' and after.isdigit() and text[start - 2:start - 1] in ('e', 'E'):
+        return ' '
+    return ''
+
+def _normalize(expression):
+    # Нормализованный текст выражения - ключ кэша. Нормализация дороже
+    # поиска в кэше, поэтому результат запоминается по исходному тексту
+    text = normalized_texts.get(expression)
+    if text is None:
+        text = _whitespace.sub(_keep_separator, expression)
+        normalized_texts.put(expression, text)
+    return text
+
+def _calculate_cached(expression, angle_unit, variables):
+    # calculate() для строки через кэши: разбор выполняется один раз для
+    # каждого нормализованного текста. Впервые встреченное выражение
+    # вычисляется обходом дерева, а компилируется при повторном вычислении,
+    # поэтому поток неповторяющихся выражений не платит за компиляцию
+    text = _normalize(expression)
+    names = tuple(sorted(variables)) if variables else ()
+    use_results = not names and result_cache.maxsize > 0
+    if use_results:
+        result = result_cache.get((text, angle_unit), _missing)
+        if result is not _missing:
+            return result
+
+    key = (text, angle_unit, names)
+    compiled = expression_cache.get(key)
+    if compiled is None:
+        tree = parse(text, names)
+        expression_cache.put(key, tree)
+        result = calculate(tree, angle_unit, variables)
+    else:
+        if not callable(compiled):
+            compiled = compile_expression(compiled, angle_unit, names)
+            expression_cache.put(key, compiled)
+        if names:
+            return compiled(*[variables[name] for name in names])
+        result = compiled()
+    if names:
+        return result
+    if use_results:
+        result_cache.put((text, angle_unit), result)
+    return result
+
+# Профиль одного вызова calculate(): время этапов в наносекундах, число
+# узлов дерева, его глубина и число вызовов каждой функции
+Profile = namedtuple('Profile', ['expression', 'angle_unit', 'timings', 'nodes', 'depth',
+                                 'function_calls', 'error'])
+
+_stages = ('tokenize', 'parse', 'postorder', 'evaluate', 'functions', 'total')
+
+class ProfileStats:
+    # Накопленная статистика профилирования. Этап functions - время внутри
+    # вызовов функций, оно входит в evaluate. last - профили последних вызовов
+    def __init__(self, keep=100):
+        self.calls = 0
+        self.errors = 0
+        self.nodes = 0
+        self.max_depth = 0
+        self.timings = dict.fromkeys(_stages, 0)
+        self.function_calls = Counter()
+        self.function_time = Counter()
+        self.last = deque(maxlen=keep)
+        self._lock = _thread.allocate_lock()
+
+    def record(self, profile, function_time):
+        with self._lock:
+            self.calls += 1
+            self.errors += profile.error is not None
+            self.nodes += profile.nodes
+            self.max_depth = max(self.max_depth, profile.depth)
+            for stage, elapsed in profile.timings.items():
+                self.timings[stage] += elapsed
+            self.function_calls.update(profile.function_calls)
+            self.function_time.update(function_time)
+            self.last.append(profile)
+
+    def report(self):
+        # Текстовый отчет для вывода в консоль
+        with self._lock:
+            calls = max(self.calls, 1)
+            lines = [f"Профиль: вызовов {self.calls}, ошибок {self.errors}",
+                     "Время этапов, мкс (всего / на вызов):"]
+            for stage in _stages:
+                elapsed = self.timings[stage] / 1000
+                lines.append(f"  {stage:10} {elapsed:12.1f} {elapsed / calls:12.1f}")
+            lines.append(f"Узлов: {self.nodes} (в среднем {self.nodes / calls:.1f}), "
+                         f"максимальная глубина: {self.max_depth}")
+            if self.function_calls:
+                lines.append("Функции (вызовов, мкс):")
+                for name, count in self.function_calls.most_common():
+                    lines.append(f"  {name:10} {count:12} {self.function_time[name] / 1000:12.1f}")
+            return "\n".join(lines)
+
+# Активная статистика профилирования; None - профилирование выключено,
+# и calculate() не делает ни одного замера времени
+profiler = None
+
+def enable_profiling(stats=None):
+    # Включаем профилирование calculate() и возвращаем объект статистики.
+    # Профилируемые вызовы проходят все этапы без кэша
+    global profiler
+    profiler = stats if stats is not None else ProfileStats()
+    return profiler
+
+def disable_profiling():
+    # Выключаем профилирование и возвращаем накопленную статистику
+    global profiler
+    stats, profiler = profiler, None
+    return stats
+
+def _calculate_profiled(stats, expression, angle_unit, variables):
+    clock = time.perf_counter_ns
+    timings = dict.fromkeys(_stages, 0)
+    function_calls = Counter()
+    function_time = Counter()
+
+    def timed(name, func):
+        def call(value):
+            function_calls[name] += 1
+            start = clock()
+            try:
+                return func(value)
+            finally:
+                function_time[name] += clock() - start
+        return call
+
+    table = {name: timed(name, func) for name, func in functions.items()}
+    order = ()
+    error = None
+    stage = 'tokenize'
+    start = mark = clock()
+
+    def lap(next_stage):
+        # Время до этой точки относим к текущему этапу, в том числе при ошибке
+        nonlocal stage, mark
+        now = clock()
+        timings[stage] += now - mark
+        stage, mark = next_stage, now
+
+    try:
+        try:
+            if isinstance(expression, str):
+                try:
+                    _check_variables(variables or ())
+                    tokens = _tokenize(expression)
+                    lap('parse')
+                    tree = _parse_tokens(tokens, variables or ())
+                except (TypeError, KeyError, ValueError) as e:
+                    raise ValueError(f"Некорректное выражение: {e}")
+            else:
+                stage = 'parse'
+                tree = _to_tree(expression)
+            lap('postorder')
+            order = postorder(tree)
+            lap('evaluate')
+            result = _walk(order, angle_unit, variables, table)
+            if math.isinf(result) or math.isnan(result):
+                raise OverflowError("Арифметическое переполнение.")
+            return result
+        except (SyntaxError, TypeError, KeyError) as e:
+            raise ValueError(f"Некорректное выражение: {e}")
+        except ZeroDivisionError:
+            raise ZeroDivisionError("Деление на ноль.")
+        except OverflowError:
+            raise OverflowError("Арифметическое переполнение.")
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        lap(None)
+        timings['total'] = mark - start
+        timings['functions'] = sum(function_time.values())
+        stats.record(Profile(expression if isinstance(expression, str) else None, angle_unit, timings,
+                             len(order), depth(order[-1]) if order else 0, dict(function_calls), error),
+                     function_time)
+
+class BatchResult(namedtuple('BatchResult', ['values', 'zero_division', 'overflow', 'invalid'])):
+    # Результат calculate_batch(): массив значений и маски ошибок по элементам.
+    # В элементах с ошибкой значение равно nan
+    __slots__ = ()
+
+    @property
+    def mask(self):
+        return self.zero_division | self.overflow | self.invalid
+
+class _ArrayEvaluator:
+    # Векторное вычисление дерева выражения над массивами NumPy. Вместо
+    # исключений ошибки отмечаются в масках, первая ошибка элемента побеждает
+    def __init__(self, np, shape, angle_unit, columns):
+        self.np = np
+        self.shape = shape
+        self.angle_unit = angle_unit
+        self.columns = columns
+        self.zero_division = np.zeros(shape, dtype=bool)
+        self.overflow = np.zeros(shape, dtype=bool)
+        self.invalid = np.zeros(shape, dtype=bool)
+        self.functions = {
+            'sqrt': np.sqrt,
+            'sin': np.sin,
+            'cos': np.cos,
+            'tg': np.tan,
+            'ln': np.log,
+            'exp': np.exp,
+        }
+
+    def flag(self, mask, where):
+        # Отмечаем ошибку только у элементов, у которых ее еще нет
+        where = self.np.broadcast_to(where, self.shape)
+        mask |= where & ~(self.zero_division | self.overflow | self.invalid)
+
+    def finite(self, result, *args):
+        # Бесконечность из конечных аргументов - переполнение
+        np = self.np
+        produced = ~np.isfinite(result)
+        for arg in args:
+            produced = produced & np.isfinite(arg)
+        self.flag(self.overflow, produced)
+        return result
+
+    def number(self, value):
+        # Целое за пределами float - переполнение во всех элементах
+        try:
+            return self.np.float64(value)
+        except OverflowError:
+            self.flag(self.overflow, True)
+            return self.np.float64(self.np.inf)
+
+    def binary(self, operation, left, right):
+        np = self.np
+        if operation is ast.Div:
+            self.flag(self.zero_division, right == 0)
+        elif operation is ast.Pow:
+            self.flag(self.zero_division, (left == 0) & (right < 0))
+            self.flag(self.invalid, (left < 0) & (np.floor(right) != right))
+        return self.finite(operators[operation](left, right), left, right)
+
+    def call(self, func_name, value):
+        np = self.np
+        if func_name in trig_functions and self.angle_unit == 'degree':
+            value = np.radians(value)
+        if func_name == 'ctg':
+            tangent = np.tan(value)
+            self.flag(self.invalid, np.isnan(tangent) & ~np.isnan(value))
+            self.flag(self.zero_division, tangent == 0)
+            return 1 / tangent
+        result = self.functions[func_name](value)
+        if func_name == 'ln':
+            self.flag(self.invalid, value <= 0)
+        self.flag(self.invalid, np.isnan(result) & ~np.isnan(value))
+        return self.finite(result, value)
+
+    def evaluate(self, tree):
+        np = self.np
+        stack = []
+        for node in postorder(tree):
+            if isinstance(node, Number):
+                stack.append(self.number(node.value))
+            elif isinstance(node, BinOp):
+                right = stack.pop()
+                stack[-1] = self.binary(node.op, stack[-1], right)
+            elif isinstance(node, UnaryOp):
+                stack[-1] = operators[node.op](stack[-1])
+            elif isinstance(node, Name):
+                if node.id in constants:
+                    stack.append(np.float64(constants[node.id]))
+                elif node.id in self.columns:
+                    stack.append(self.columns[node.id])
+                else:
+                    raise ValueError(f"Неизвестная константа: {node.id}")
+            elif isinstance(node, Call):
+                func_name = node.func
+                if func_name not in functions:
+                    raise ValueError(f"Неизвестная функция: {func_name}")
+                if len(node.args) != 1:
+                    raise ValueError(f"Функция {func_name} принимает ровно 1 аргумент")
+                stack[-1] = self.call(func_name, stack[-1])
+            else:
+                raise TypeError(f"Неверное выражение: неподдерживаемый узел AST {type(node)}")
+        return stack[0]
+
+def calculate_batch(expression, angle_unit='radian', **columns):
+    # Вычисляем выражение над столбцами значений переменных за один векторный
+    # проход. Столбцы - массивы NumPy или любые объекты с протоколом буфера
+    import numpy as np
+
+    try:
+        tree = _to_tree(expression, tuple(columns))
+        columns = {name: np.asarray(column, dtype=np.float64) for name, column in columns.items()}
+        shape = np.broadcast_shapes(*(column.shape for column in columns.values()))
+        evaluator = _ArrayEvaluator(np, shape, angle_unit, columns)
+        with np.errstate(all='ignore'):
+            values = evaluator.evaluate(tree)
+            values = np.array(np.broadcast_to(values, shape), dtype=np.float64)
+            evaluator.flag(evaluator.overflow, ~np.isfinite(values))
+    except (SyntaxError, TypeError, KeyError) as e:
+        raise ValueError(f"Некорректное выражение: {e}")
+
+    result = BatchResult(values, evaluator.zero_division, evaluator.overflow, evaluator.invalid)
+    values[result.mask] = np.nan
+    return result
+
+def batch_line(line, angle_unit='radian', fmt='text'):
+    # Вычисляем одну строку пакетного режима. Возвращаем признак успеха
+    # и строку вывода; ошибка выводится в строке, а не прерывает пакет
+    if fmt == 'jsonl':
+        import json
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("ожидается объект")
+        except ValueError as e:
+            return False, json.dumps({'error': f"Некорректная строка JSON: {e}"}, ensure_ascii=False)
+        record.setdefault('angle_unit', angle_unit)
+        try:
+            if record['angle_unit'] not in ('degree', 'radian'):
+                raise ValueError(f"Неизвестные единицы измерения углов: {record['angle_unit']}")
+            result = try_calculate(record.get('expression', ''), record['angle_unit'], record.get('variables'))
+        except Exception as e:
+            result = Result(ERROR, None, str(e))
+        if result.ok:
+            record['result'] = result.value
+        else:
+            record['error'] = result.message
+        return result.ok, json.dumps(record, ensure_ascii=False)
+    try:
+        result = try_calculate(line, angle_unit)
+    except Exception as e:
+        result = Result(ERROR, None, str(e))
+    return (True, str(result.value)) if result.ok else (False, f"Ошибка: {result.message}")
+
+def _batch_chunk(lines, angle_unit, fmt):
+    return [batch_line(line, angle_unit, fmt) for line in lines]
+
+def _chunks(lines, size):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _ordered_chunks(func, chunks, workers, *args):
+    # Применяем func к пачкам в пуле процессов и возвращаем результаты в
+    # порядке пачек. В работе одновременно не больше 2 * workers пачек,
+    # поэтому память не зависит от размера ввода
+    from concurrent.futures import ProcessPoolExecutor
+
+    pool = ProcessPoolExecutor(workers)
+    pending = deque()
+    try:
+        for chunk in chunks:
+            pending.append(pool.submit(func, chunk, *args))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        # Если результаты перестали забирать, непосчитанные пачки отменяются
+        pool.shutdown(cancel_futures=True)
+
+def run_batch(lines, output, angle_unit='radian', fmt='text', workers=1, chunksize=256):
+    # Потоково вычисляем строки и пишем результаты в output в порядке ввода.
+    # При workers > 1 пачки строк вычисляются в пуле процессов. Возвращаем
+    # число строк с ошибками
+    errors = 0
+    lines = (line.rstrip('\r\n') for line in lines)
+    if workers <= 1:
+        for line in lines:
+            ok, text = batch_line(line, angle_unit, fmt)
+            errors += not ok
+            output.write(text + '\n')
+            output.flush()
+        return errors
+
+    for results in _ordered_chunks(_batch_chunk, _chunks(lines, chunksize), workers, angle_unit, fmt):
+        for ok, text in results:
+            errors += not ok
+            output.write(text + '\n')
+        output.flush()
+    return errors
+
+def _calculate_one(expression, angle_unit, variables):
+    try:
+        return calculate(expression, angle_unit, variables)
+    except Exception as e:
+        return e
+
+class _Flat(tuple):
+    # Дерево для передачи в процесс пула: узлы в обратной польской записи
+    # парами (класс узла, аргумент) без ссылок друг на друга. pickle обходит
+    # вложенные узлы рекурсией и не справляется с глубоким деревом
+    __slots__ = ()
+
+def _flatten(expression):
+    if not isinstance(expression, (Number, Name, BinOp, UnaryOp, Call)):
+        return expression
+    flat = []
+    for node in postorder(expression):
+        if isinstance(node, Number):
+            flat.append((Number, node.value))
+        elif isinstance(node, Name):
+            flat.append((Name, node.id))
+        elif isinstance(node, Call):
+            flat.append((Call, (node.func, len(node.args))))
+        else:
+            flat.append((type(node), node.op))
+    return _Flat(flat)
+
+def _unflatten(flat):
+    # Обратное преобразование на явном стеке
+    stack = []
+    for kind, arg in flat:
+        if kind is Number or kind is Name:
+            stack.append(kind(arg))
+        elif kind is UnaryOp:
+            stack[-1] = UnaryOp(arg, stack[-1])
+        elif kind is BinOp:
+            right = stack.pop()
+            stack[-1] = BinOp(arg, stack[-1], right)
+        else:
+            func_name, n = arg
+            args = stack[len(stack) - n:]
+            del stack[len(stack) - n:]
+            stack.append(Call(func_name, args))
+    return stack[0]
+
+def _calculate_chunk(expressions, angle_unit, variables):
+    return [_calculate_one(_unflatten(expression) if type(expression) is _Flat else expression,
+                           angle_unit, variables) for expression in expressions]
+
+def calculate_many(expressions, angle_unit='radian', workers=None, chunksize=256, variables=None):
+    # Лениво вычисляем независимые выражения и возвращаем результаты в порядке
+    # ввода; ошибка возвращается на месте результата как объект исключения.
+    # При workers > 1 (по умолчанию - число ядер) пачки по chunksize выражений
+    # вычисляются в пуле процессов. Строки передаются процессам как есть:
+    # разбор в основном процессе выполнялся бы последовательно, а каждый
+    # процесс разбирает повторяющиеся выражения один раз благодаря своему
+    # кэшу. Готовые деревья передаются процессам без повторного разбора,
+    # плоским списком узлов
+    if workers is None:
+        import os
+        workers = os.cpu_count() or 1
+    if workers <= 1:
+        for expression in expressions:
+            yield _calculate_one(expression, angle_unit, variables)
+        return
+
+    chunks = _chunks(map(_flatten, expressions), chunksize)
+    for results in _ordered_chunks(_calculate_chunk, chunks, workers, angle_unit, variables):
+        yield from results
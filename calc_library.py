@@ -0,0 +1,290 @@
+import os
+import ast
+import mmap
+import struct
+import zlib
+import threading
+from array import array
+from collections import namedtuple
+
+import calc_core
+
+# Библиотека скомпилированных формул в одном файле. Файл отображается в
+# память, и формула декодируется только при первом обращении к ней, поэтому
+# загрузка библиотеки не зависит от числа формул. Числа little-endian:
+#   заголовок: сигнатура, версия, число формул, crc32 всего, что после заголовка
+#   индекс: для каждой формулы в порядке имен (байты UTF-8) смещение и длина
+#           имени, смещение и длина записи
+#   имена формул
+#   записи, каждая выровнена на 8 байт
+# Запись: заголовок записи, пул вещественных констант (double), пул целых
+# констант (int64), команды программы в обратной польской записи (пары
+# uint32: код и аргумент), исходный текст и имена переменных через \0
+
+MAGIC = b'CALCLIB\0'
+VERSION = 1
+
+_header = struct.Struct('<8sHHII4x')
+_entry = struct.Struct('<QIQI')
+_record = struct.Struct('<BBHIIIII')
+
+# Коды команд в файле
+_FLOAT, _INT, _LOAD, _BINARY, _UNARY, _CALL, _STORE, _RECALL = range(8)
+
+# Таблицы, номера в которых записываются в файл; меняются только вместе
+# с версией формата
+_binary_operations = (ast.Add, ast.Sub, ast.Mult, ast.Div, ast.Pow)
+_unary_operations = (ast.USub,)
+_function_names = ('sqrt', 'sin', 'cos', 'tg', 'ctg', 'ln', 'exp')
+_angle_units = ('radian', 'degree')
+
+# Запись без программы: формула компилируется из исходного текста при
+# первом обращении (целые константы вне int64, неизвестные формату функции)
+_SOURCE_ONLY = 1
+
+Formula = namedtuple('Formula', ['expression', 'variables', 'angle_unit'])
+
+def _align(size):
+    return -size % 8
+
+def _encode(expression, variables, angle_unit):
+    # Программа формулы: пулы констант и команды, или None, если формулу
+    # можно сохранить только исходным текстом
+    tree = calc_core.optimize(calc_core.parse(expression, variables), angle_unit)
+    floats = array('d')
+    ints = array('q')
+    code = array('I')
+    for op, arg in calc_core._assemble(tree, variables):
+        if op == calc_core._PUSH:
+            if type(arg) is int:
+                if not -2 ** 63 <= arg < 2 ** 63:
+                    return None
+                code.extend((_INT, len(ints)))
+                ints.append(arg)
+            else:
+                code.extend((_FLOAT, len(floats)))
+                floats.append(arg)
+        elif op == calc_core._BINARY:
+            operation, guarded = arg
+            code.extend((_BINARY, _binary_operations.index(operation) * 2 + guarded))
+        elif op == calc_core._APPLY:
+            if type(arg) is str:
+                if arg not in _function_names:
+                    return None
+                code.extend((_CALL, _function_names.index(arg)))
+            else:
+                code.extend((_UNARY, _unary_operations.index(arg)))
+        elif op == calc_core._CALL:
+            return None
+        else:
+            code.extend(({calc_core._LOAD: _LOAD, calc_core._STORE: _STORE, calc_core._RECALL: _RECALL}[op], arg))
+    return floats, ints, code
+
+def _record_bytes(expression, variables, angle_unit):
+    try:
+        encoded = _encode(expression, variables, angle_unit)
+    except (ArithmeticError, ValueError, TypeError):
+        # Ошибка при сворачивании констант остается ошибкой вычисления
+        encoded = None
+    flags = 0
+    if encoded is None:
+        flags = _SOURCE_ONLY
+        encoded = array('d'), array('q'), array('I')
+    floats, ints, code = encoded
+    source = expression.encode('utf-8')
+    names = '\0'.join(variables).encode('utf-8')
+    parts = [
+        _record.pack(_angle_units.index(angle_unit), flags, len(variables), len(code) // 2,
+                     len(floats), len(ints), len(source), len(names)),
+        floats.tobytes(), ints.tobytes(), code.tobytes(), source, names,
+    ]
+    return b''.join(parts)
+
+def write_library(path, formulas, angle_unit='radian'):
+    # Сохраняем формулы в файл библиотеки. formulas - словарь: имя ->
+    # выражение или пара (выражение, имена переменных). Файл заменяется
+    # целиком, поэтому процессы, отобразившие старый файл, не затрагиваются
+    if angle_unit not in _angle_units:
+        raise ValueError(f"Неизвестные единицы измерения углов: {angle_unit}")
+    entries = []
+    for name, formula in formulas.items():
+        expression, variables = (formula, ()) if isinstance(formula, str) else formula
+        variables = tuple(variables)
+        try:
+            calc_core.parse(expression, variables)
+        except ValueError as e:
+            raise ValueError(f"Формула {name}: {e}")
+        entries.append((name.encode('utf-8'), _record_bytes(expression, variables, angle_unit)))
+    entries.sort(key=lambda entry: entry[0])
+
+    names_offset = _header.size + len(entries) * _entry.size
+    offset = names_offset + sum(len(name) for name, _ in entries)
+    offset += _align(offset)
+    index = []
+    name_offset = names_offset
+    for name, record in entries:
+        index.append(_entry.pack(name_offset, len(name), offset, len(record)))
+        name_offset += len(name)
+        offset += len(record) + _align(len(record))
+
+    body = [b''.join(index), b''.join(name for name, _ in entries)]
+    body.append(b'\0' * _align(name_offset))
+    for _, record in entries:
+        body.append(record)
+        body.append(b'\0' * _align(len(record)))
+    body = b''.join(body)
+
+    temporary = f"{path}.tmp"
+    with open(temporary, 'wb') as file:
+        file.write(_header.pack(MAGIC, VERSION, 0, len(entries), zlib.crc32(body)))
+        file.write(body)
+    os.replace(temporary, path)
+
+class Library:
+    # Библиотека формул, отображенная в память. library[name] возвращает
+    # скомпилированную функцию, которая принимает значения переменных
+    # позиционно в порядке variables и вычисляет формулу так же, как
+    # calculate(). Имя ищется двоичным поиском по индексу файла
+    def __init__(self, path, verify=True):
+        with open(path, 'rb') as file:
+            size = os.fstat(file.fileno()).st_size
+            if size < _header.size:
+                raise ValueError("Неверный формат библиотеки формул")
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, _, count, checksum = _header.unpack_from(self._map)
+        if magic != MAGIC:
+            self._map.close()
+            raise ValueError("Неверный формат библиотеки формул")
+        if version != VERSION:
+            self._map.close()
+            raise ValueError(f"Неподдерживаемая версия библиотеки формул: {version}")
+        if verify:
+            with memoryview(self._map) as view:
+                valid = zlib.crc32(view[_header.size:]) == checksum
+            if not valid:
+                self._map.close()
+                raise ValueError("Контрольная сумма библиотеки формул не совпадает")
+        self._count = count
+        self._compiled = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._map.close()
+
+    def __len__(self):
+        return self._count
+
+    def _entry(self, i):
+        return _entry.unpack_from(self._map, _header.size + i * _entry.size)
+
+    def _name(self, i):
+        name_offset, name_length, _, _ = self._entry(i)
+        return self._map[name_offset:name_offset + name_length]
+
+    def __iter__(self):
+        for i in range(self._count):
+            yield self._name(i).decode('utf-8')
+
+    def _find(self, name):
+        # Смещение записи формулы или None
+        key = name.encode('utf-8')
+        data = self._map
+        unpack = _entry.unpack_from
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            name_offset, name_length, offset, _ = unpack(data, _header.size + middle * _entry.size)
+            current = data[name_offset:name_offset + name_length]
+            if current < key:
+                low = middle + 1
+            elif current > key:
+                high = middle
+            else:
+                return offset
+        return None
+
+    def __contains__(self, name):
+        return self._find(name) is not None
+
+    def _read(self, offset):
+        # Заголовок записи и представления пулов и команд без копирования
+        unit, flags, n_vars, n_code, n_floats, n_ints, source_length, names_length = (
+            _record.unpack_from(self._map, offset))
+        view = memoryview(self._map)
+        position = offset + _record.size
+        floats = view[position:position + 8 * n_floats].cast('d')
+        position += 8 * n_floats
+        ints = view[position:position + 8 * n_ints].cast('q')
+        position += 8 * n_ints
+        code = view[position:position + 8 * n_code].cast('I')
+        position += 8 * n_code
+        source = str(view[position:position + source_length], 'utf-8')
+        position += source_length
+        names = str(view[position:position + names_length], 'utf-8')
+        variables = tuple(names.split('\0')) if n_vars else ()
+        formula = Formula(source, variables, _angle_units[unit])
+        return formula, flags, view, floats, ints, code
+
+    def formula(self, name):
+        # Исходный текст, имена переменных и единицы измерения углов формулы
+        offset = self._find(name)
+        if offset is None:
+            raise KeyError(name)
+        formula, _, *views = self._read(offset)
+        for view in reversed(views):
+            view.release()
+        return formula
+
+    def _decode(self, offset):
+        formula, flags, view, floats, ints, code = self._read(offset)
+        try:
+            if flags & _SOURCE_ONLY:
+                return calc_core.compile_expression(formula.expression, formula.angle_unit, formula.variables)
+            program = []
+            for i in range(0, len(code), 2):
+                op, arg = code[i], code[i + 1]
+                if op == _FLOAT:
+                    program.append((calc_core._PUSH, floats[arg]))
+                elif op == _INT:
+                    program.append((calc_core._PUSH, ints[arg]))
+                elif op == _BINARY:
+                    program.append((calc_core._BINARY, (_binary_operations[arg // 2], bool(arg % 2))))
+                elif op == _UNARY:
+                    program.append((calc_core._APPLY, _unary_operations[arg]))
+                elif op == _CALL:
+                    program.append((calc_core._APPLY, _function_names[arg]))
+                elif op == _LOAD:
+                    program.append((calc_core._LOAD, arg))
+                elif op == _STORE:
+                    program.append((calc_core._STORE, arg))
+                elif op == _RECALL:
+                    program.append((calc_core._RECALL, arg))
+                else:
+                    raise ValueError(f"Неизвестная команда в библиотеке формул: {op}")
+            return calc_core._checked(calc_core._interpreter(calc_core._link(program, calc_core._ModuleRegistry(formula.angle_unit))))
+        finally:
+            for item in (code, ints, floats, view):
+                item.release()
+
+    def get(self, name, default=None):
+        compiled = self._compiled.get(name)
+        if compiled is None:
+            offset = self._find(name)
+            if offset is None:
+                return default
+            compiled = self._decode(offset)
+            with self._lock:
+                compiled = self._compiled.setdefault(name, compiled)
+        return compiled
+
+    def __getitem__(self, name):
+        compiled = self.get(name)
+        if compiled is None:
+            raise KeyError(name)
+        return compiled
@@ -0,0 +1,197 @@
+import sys
+import math
+
+import calc_core
+
+# Вычисление выражения в точках диапазона для графиков и таблиц. Выражение
+# разбирается и компилируется один раз, точки выдаются генератором по мере
+# вычисления, поэтому память не зависит от числа точек
+
+# Число точек сетки, если не заданы ни num, ни step
+DEFAULT_POINTS = 101
+
+def _axis(start, stop, num, step):
+    # Число точек и шаг одной оси. Шаг задается по модулю, направление - от
+    # start к stop; последняя точка не выходит за stop
+    if step is not None:
+        if not step > 0:
+            raise ValueError("Шаг сетки должен быть положительным")
+        count = int(math.floor(abs(stop - start) / step * (1 + 1e-12))) + 1
+        return count, step if stop >= start else -step
+    num = DEFAULT_POINTS if num is None else num
+    if num < 1:
+        raise ValueError("Число точек сетки должно быть положительным")
+    if num == 1:
+        return 1, 0
+    return num, (stop - start) / (num - 1)
+
+def _value(compiled, *values):
+    # Значение в точке или объект исключения, как у calculate_many()
+    try:
+        return compiled(*values)
+    except Exception as e:
+        return e
+
+def _per_axis(value, n, name):
+    if isinstance(value, (list, tuple)):
+        if len(value) != n:
+            raise ValueError(f"Для {name} нужно {n} значений, по одному на переменную")
+        return tuple(value)
+    return (value,) * n
+
+def sample(expression, var, start, stop, num=None, step=None, angle_unit='radian', variables=None,
+           adaptive=False, tolerance=1e-3, max_depth=10):
+    # Генератор пар (x, значение) на сетке от start до stop: num точек или шаг
+    # step. Если var - последовательность имен, сетка многомерная: start, stop,
+    # num и step задаются для каждой оси (или одно значение на все оси), x -
+    # кортеж координат, последняя ось меняется быстрее всех. Ошибка в точке
+    # возвращается на месте значения как объект исключения. variables -
+    # значения остальных переменных выражения.
+    # adaptive=True (только для одной переменной): сетка num точек
+    # уточняется делением отрезков пополам там, где выражение отклоняется от
+    # прямой больше чем на tolerance (относительно величины значений), и на
+    # границах областей ошибок - у полюсов tg и ctg, у нуля для ln. Каждый
+    # отрезок сетки делится не более max_depth раз
+    names = (var,) if isinstance(var, str) else tuple(var)
+    if not names:
+        raise ValueError("Не заданы переменные сетки")
+    variables = dict(variables or {})
+    for name in names:
+        variables.pop(name, None)
+    fixed = tuple(variables.values())
+    compiled = calc_core.compile_expression(expression, angle_unit, names + tuple(variables))
+    if isinstance(var, str):
+        axes = [_axis(start, stop, num, step)]
+        starts = (start,)
+    else:
+        starts = _per_axis(start, len(names), 'start')
+        axes = [_axis(*args) for args in zip(starts, _per_axis(stop, len(names), 'stop'),
+                                             _per_axis(num, len(names), 'num'),
+                                             _per_axis(step, len(names), 'step'))]
+    if adaptive:
+        if len(names) != 1:
+            raise ValueError("Адаптивная сетка поддерживается только для одной переменной")
+        points = _adaptive(compiled, fixed, starts[0], axes[0], tolerance, max_depth)
+        if isinstance(var, str):
+            return points
+        # Для последовательности имен x - кортеж координат, как у обычной сетки
+        return (((x,), value) for x, value in points)
+    if isinstance(var, str):
+        return _line(compiled, fixed, start, axes[0])
+    return _grid(compiled, fixed, starts, axes)
+
+def _line(compiled, fixed, start, axis):
+    count, step = axis
+    for i in range(count):
+        x = start + i * step
+        yield x, _value(compiled, x, *fixed)
+
+def _grid(compiled, fixed, starts, axes):
+    # Обход многомерной сетки счетчиком индексов: в памяти только текущая точка
+    counts = [count for count, _ in axes]
+    if not all(counts):
+        return
+    index = [0] * len(axes)
+    point = [start + 0 * step for start, (_, step) in zip(starts, axes)]
+    while True:
+        yield tuple(point), _value(compiled, *point, *fixed)
+        axis = len(axes) - 1
+        while axis >= 0:
+            index[axis] += 1
+            if index[axis] < counts[axis]:
+                point[axis] = starts[axis] + index[axis] * axes[axis][1]
+                break
+            index[axis] = 0
+            point[axis] = starts[axis] + 0 * axes[axis][1]
+            axis -= 1
+        if axis < 0:
+            return
+
+def _refine(left, middle, right, tolerance):
+    # Нужно ли делить отрезок: значение в середине далеко от прямой через
+    # концы, или на отрезке меняется наличие ошибки
+    errors = isinstance(left, Exception) + isinstance(middle, Exception) + isinstance(right, Exception)
+    if errors:
+        return errors < 3
+    deviation = abs(middle - (left + right) / 2)
+    return deviation > tolerance * max(1.0, abs(left), abs(middle), abs(right))
+
+def _adaptive(compiled, fixed, start, axis, tolerance, max_depth):
+    # Отрезки исходной сетки уточняются в глубину слева направо, поэтому
+    # точки выдаются по возрастанию x, а в памяти не больше max_depth отрезков
+    count, step = axis
+    x0 = start
+    f0 = _value(compiled, x0, *fixed)
+    yield x0, f0
+    for i in range(1, count):
+        x1 = start + i * step
+        f1 = _value(compiled, x1, *fixed)
+        pending = [(x0, f0, x1, f1, 0)]
+        while pending:
+            left, f_left, right, f_right, level = pending.pop()
+            middle = (left + right) / 2
+            f_middle = _value(compiled, middle, *fixed)
+            if level < max_depth and _refine(f_left, f_middle, f_right, tolerance):
+                pending.append((middle, f_middle, right, f_right, level + 1))
+                pending.append((left, f_left, middle, f_middle, level + 1))
+            else:
+                yield middle, f_middle
+                yield right, f_right
+        x0, f0 = x1, f1
+
+def main(argv=None):
+    # Подкоманда sample: python3 calc.py sample EXPRESSION --range x 0 10 ...
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        prog="Калькулятор sample",
+        description="Значения выражения на сетке: по строке на точку, координаты и значение через табуляцию.")
+    parser.add_argument("expression", help="Математическое выражение")
+    parser.add_argument("--range", nargs=3, action="append", required=True, metavar=("NAME", "START", "STOP"),
+                        help="Переменная и ее диапазон; несколько --range задают многомерную сетку")
+    parser.add_argument("--num", type=int, help=f"Число точек по каждой оси (по умолчанию: {DEFAULT_POINTS})")
+    parser.add_argument("--step", type=float, help="Шаг сетки вместо числа точек")
+    parser.add_argument("--adaptive", action="store_true",
+                        help="Уточнять сетку там, где выражение искривляется или не определено "
+                             "(только для одной переменной)")
+    parser.add_argument("--tolerance", type=float, default=1e-3,
+                        help="Допустимое отклонение от прямой при уточнении (по умолчанию: 0.001)")
+    parser.add_argument("--max-depth", type=int, default=10,
+                        help="Сколько раз можно делить отрезок сетки при уточнении (по умолчанию: 10)")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                        help="Значение другой переменной выражения")
+    parser.add_argument("--angle-unit", choices=["degree", "radian"], default="radian",
+                        help="Единицы измерения углов (по умолчанию: radian)")
+    args = parser.parse_args(argv)
+
+    try:
+        names = [name for name, _, _ in args.range]
+        starts = [float(start) for _, start, _ in args.range]
+        stops = [float(stop) for _, _, stop in args.range]
+        variables = {}
+        for item in args.set:
+            name, separator, value = item.partition("=")
+            if not separator:
+                raise ValueError(f"Ожидается NAME=VALUE: {item}")
+            variables[name] = float(value)
+        if len(names) == 1:
+            points = sample(args.expression, names[0], starts[0], stops[0], args.num, args.step,
+                            args.angle_unit, variables, args.adaptive, args.tolerance, args.max_depth)
+        else:
+            points = sample(args.expression, names, starts, stops, args.num, args.step,
+                            args.angle_unit, variables, args.adaptive, args.tolerance, args.max_depth)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+
+    errors = 0
+    for point, value in points:
+        coordinates = "\t".join(map(str, point if isinstance(point, tuple) else (point,)))
+        if isinstance(value, Exception):
+            errors += 1
+            value = f"Ошибка: {value}"
+        print(f"{coordinates}\t{value}")
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
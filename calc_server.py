@@ -0,0 +1,254 @@
+import sys
+import os
+import json
+import socket
+import asyncio
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from calc_core import batch_line
+
+# Протокол: по одному запросу на строку, ответы приходят в порядке запросов.
+# Строка, начинающаяся с "{", - запрос JSON с полями expression, angle_unit,
+# variables (и любыми другими, например id), ответ - тот же объект с полем
+# result или error. Любая другая строка - выражение, ответ - значение или
+# "Ошибка: <сообщение>"
+
+# Строки длиннее этого вычисляются в пуле процессов, чтобы не задерживать
+# остальные запросы; короткие вычисляются сразу с общим кэшем выражений
+HEAVY_REQUEST_SIZE = 4096
+# Сколько запросов одного соединения может ждать ответа
+PIPELINE_DEPTH = 1024
+# Максимальная длина строки запроса
+LINE_LIMIT = 16 * 1024 * 1024
+
+def _request(line, angle_unit):
+    fmt = 'jsonl' if line.lstrip().startswith('{') else 'text'
+    return batch_line(line, angle_unit, fmt)[1]
+
+def _failure(line, error):
+    # Ответ на запрос, который не удалось вычислить в пуле процессов: в том
+    # же формате, что ответ batch_line() с ошибкой
+    message = str(error) or type(error).__name__
+    if line.lstrip().startswith('{'):
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        if not isinstance(record, dict):
+            record = {}
+        record['error'] = message
+        return json.dumps(record, ensure_ascii=False)
+    return f"Ошибка: {message}"
+
+async def _handle(reader, writer, pool, slots, angle_unit):
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(PIPELINE_DEPTH)
+
+    async def heavy(line):
+        try:
+            async with slots:
+                return await loop.run_in_executor(pool, _request, line, angle_unit)
+        except Exception as e:
+            return _failure(line, e)
+
+    async def respond():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            if not isinstance(item, str):
+                item = await item
+            if writer.is_closing():
+                raise ConnectionResetError("Соединение закрыто")
+            writer.write(item.encode('utf-8') + b'\n')
+            if queue.empty():
+                await writer.drain()
+
+    responder = asyncio.create_task(respond())
+
+    async def enqueue(item):
+        # Ставим ответ в очередь. Если очередь полна, ждем места, пока
+        # ответы отправляются; False - отправка ответов прекратилась
+        if not queue.full():
+            queue.put_nowait(item)
+            return True
+        waiter = asyncio.ensure_future(queue.put(item))
+        await asyncio.wait((waiter, responder), return_when=asyncio.FIRST_COMPLETED)
+        if waiter.done():
+            return True
+        waiter.cancel()
+        return False
+
+    try:
+        while not responder.done() and not writer.is_closing():
+            try:
+                line = await reader.readline()
+            except (ValueError, ConnectionError):
+                break
+            if not line:
+                break
+            line = line.decode('utf-8', errors='replace').rstrip('\r\n')
+            if len(line) > HEAVY_REQUEST_SIZE:
+                item = asyncio.ensure_future(heavy(line))
+            else:
+                item = _request(line, angle_unit)
+            if not await enqueue(item):
+                if not isinstance(item, str):
+                    item.cancel()
+                break
+        # Клиент закончил: отправляем ответы на все принятые запросы
+        if not responder.done() and await enqueue(None):
+            await asyncio.wait((responder,))
+    finally:
+        # Соединение разорвано или сервер останавливается: ответы больше не
+        # отправляются, непосчитанные запросы отменяются
+        responder.cancel()
+        while not queue.empty():
+            item = queue.get_nowait()
+            if item is not None and not isinstance(item, str):
+                item.cancel()
+        await asyncio.wait((responder,))
+        if not responder.cancelled():
+            responder.exception()
+        writer.close()
+
+async def start_server(host='127.0.0.1', port=8765, path=None, workers=None, angle_unit='radian'):
+    # Запускаем сервер на сокете Unix (path) или на TCP-порту. Возвращаем
+    # объект asyncio.Server; пул процессов закрывается вместе с ним
+    # Процессы пула не наследуют открытые соединения: при fork закрытое
+    # сервером соединение оставалось бы открытым в процессе пула
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context(method))
+    slots = asyncio.Semaphore(workers or os.cpu_count() or 1)
+
+    def handler(reader, writer):
+        return _handle(reader, writer, pool, slots, angle_unit)
+
+    if path is not None:
+        server = await asyncio.start_unix_server(handler, path, limit=LINE_LIMIT)
+    else:
+        server = await asyncio.start_server(handler, host, port, limit=LINE_LIMIT)
+    server.pool = pool
+    return server
+
+def serve(host='127.0.0.1', port=8765, path=None, workers=None, angle_unit='radian'):
+    async def run():
+        server = await start_server(host, port, path, workers, angle_unit)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            server.pool.shutdown()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+# Исключения, восстанавливаемые клиентом по тексту ошибки
+_errors = {
+    "Деление на ноль.": ZeroDivisionError,
+    "Арифметическое переполнение.": OverflowError,
+    "Превышено время вычисления.": TimeoutError,
+}
+
+def _error(message):
+    return _errors.get(message, ValueError)(message)
+
+class Client:
+    # Тонкий клиент сервера калькулятора. Запросы отправляются, не дожидаясь
+    # ответов на предыдущие; в пути одновременно не больше window запросов
+    def __init__(self, host='127.0.0.1', port=8765, path=None, timeout=None, window=256):
+        if path is not None:
+            self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.socket.settimeout(timeout)
+            self.socket.connect(path)
+        else:
+            self.socket = socket.create_connection((host, port), timeout)
+        self.file = self.socket.makefile('rwb')
+        self.window = window
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.file.close()
+        self.socket.close()
+
+    def _send(self, request):
+        self.file.write(json.dumps(request, ensure_ascii=False).encode('utf-8') + b'\n')
+
+    def _receive(self):
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError("Сервер закрыл соединение")
+        response = json.loads(line)
+        if 'error' in response:
+            return _error(response['error'])
+        return response['result']
+
+    def calculate(self, expression, angle_unit=None, variables=None):
+        result = next(self.calculate_many([expression], angle_unit, variables))
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def calculate_many(self, expressions, angle_unit=None, variables=None):
+        # Результаты в порядке выражений; ошибка возвращается на месте
+        # результата как объект исключения
+        request = {}
+        if angle_unit is not None:
+            request['angle_unit'] = angle_unit
+        if variables is not None:
+            request['variables'] = variables
+        in_flight = 0
+        for expression in expressions:
+            self._send(dict(request, expression=expression))
+            in_flight += 1
+            if in_flight >= self.window:
+                self.file.flush()
+                yield self._receive()
+                in_flight -= 1
+        self.file.flush()
+        for _ in range(in_flight):
+            yield self._receive()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="Калькулятор",
+        description="Сервер калькулятора и клиент к нему. Запросы - строки с выражением "
+                    "или объекты JSON с полями expression, angle_unit и variables.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    for name, help in [("serve", "Запустить сервер"), ("client", "Отправить выражения из stdin на сервер")]:
+        command = commands.add_parser(name, help=help)
+        command.add_argument("--host", default="127.0.0.1", help="Адрес TCP (по умолчанию: 127.0.0.1)")
+        command.add_argument("--port", type=int, default=8765, help="Порт TCP (по умолчанию: 8765)")
+        command.add_argument("--socket", help="Путь к сокету Unix вместо TCP")
+        command.add_argument("--angle-unit", choices=["degree", "radian"], default=None,
+                             help="Единицы измерения углов (по умолчанию: radian)")
+    commands.choices["serve"].add_argument("--workers", type=int, default=None,
+                                           help="Число процессов для длинных выражений (по умолчанию: число ядер)")
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        serve(args.host, args.port, args.socket, args.workers, args.angle_unit or 'radian')
+        return 0
+
+    errors = 0
+    with Client(args.host, args.port, args.socket) as client:
+        lines = (line.rstrip('\r\n') for line in sys.stdin)
+        for result in client.calculate_many(lines, args.angle_unit):
+            if isinstance(result, Exception):
+                errors += 1
+                print(f"Ошибка: {result}")
+            else:
+                print(result)
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
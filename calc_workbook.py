@@ -0,0 +1,222 @@
+import calc_core
+
+# После скольких вычислений обходом дерева формула компилируется. Компиляция
+# стоит примерно как десять обходов, поэтому окупается только для формул,
+# которые пересчитываются часто
+COMPILE_AFTER = 8
+
+# Формула книги: дерево выражения, имена, на которые она ссылается, число
+# вычислений и скомпилированная функция
+class _Formula:
+    __slots__ = ('expression', 'tree', 'dependencies', 'evaluations', 'compiled')
+
+    def __init__(self, expression, tree, dependencies):
+        self.expression = expression
+        self.tree = tree
+        self.dependencies = dependencies
+        self.evaluations = 0
+        self.compiled = None
+
+def _dependencies(tree):
+    # Имена, на которые ссылается выражение, в порядке первого появления
+    names = {}
+    for node in calc_core.postorder(tree):
+        if isinstance(node, calc_core.Name) and node.id not in calc_core.constants:
+            names[node.id] = None
+    return tuple(names)
+
+def _error(error):
+    # Новое исключение того же типа, чтобы не копить трассировки в общем объекте
+    return type(error)(*error.args)
+
+class Workbook:
+    # Именованные входные значения и формулы, ссылающиеся друг на друга,
+    # как ячейки электронной таблицы. Значения формул хранятся; изменение
+    # входа или формулы отмечает зависящие от нее формулы, и при следующем
+    # чтении пересчитываются только они, в топологическом порядке. Ошибка
+    # формулы становится ее значением и передается зависящим формулам
+    def __init__(self, angle_unit='radian'):
+        self.angle_unit = angle_unit
+        self._inputs = {}
+        self._formulas = {}
+        self._dependents = {}
+        self._values = {}
+        self._dirty = set()
+
+    def __contains__(self, name):
+        return name in self._inputs or name in self._formulas
+
+    def __len__(self):
+        return len(self._inputs) + len(self._formulas)
+
+    def __iter__(self):
+        yield from self._inputs
+        yield from self._formulas
+
+    def expression(self, name):
+        return self._formulas[name].expression
+
+    def dependencies(self, name):
+        # Имена, на которые ссылается формула
+        formula = self._formulas.get(name)
+        return formula.dependencies if formula is not None else ()
+
+    def dependents(self, name):
+        # Формулы, которые ссылаются на имя
+        return frozenset(self._dependents.get(name, ()))
+
+    def set(self, name, value):
+        # Задаем входное значение; формула с этим именем заменяется значением
+        calc_core._check_variables([name])
+        if name in self._formulas:
+            self._remove(name)
+        self._inputs[name] = value
+        self._invalidate(name)
+
+    def update(self, values):
+        for name, value in values.items():
+            self.set(name, value)
+
+    def define(self, name, expression):
+        # Задаем формулу. Ссылки на еще не заданные имена допустимы; ссылка,
+        # которая замыкает цикл, - ошибка, и книга при этом не меняется
+        calc_core._check_variables([name])
+        try:
+            tokens = calc_core._tokenize(expression)
+        except ValueError as e:
+            raise ValueError(f"Некорректное выражение: {e}")
+        candidates = [token for token in tokens
+                      if type(token) is str and token[0].isalpha()
+                      and token not in calc_core.functions and token not in calc_core.constants]
+        tree = calc_core.parse(expression, candidates)
+        dependencies = _dependencies(tree)
+        self._check_cycle(name, dependencies)
+        if name in self._formulas:
+            self._unlink(name)
+        self._inputs.pop(name, None)
+        self._formulas[name] = _Formula(expression, tree, dependencies)
+        for dependency in dependencies:
+            self._dependents.setdefault(dependency, set()).add(name)
+        self._invalidate(name)
+
+    def delete(self, name):
+        if name in self._formulas:
+            self._remove(name)
+        else:
+            del self._inputs[name]
+        self._invalidate(name)
+
+    def _remove(self, name):
+        # Убираем формулу вместе с ее значением и отметкой о пересчете
+        self._unlink(name)
+        del self._formulas[name]
+        self._values.pop(name, None)
+        self._dirty.discard(name)
+
+    def _unlink(self, name):
+        for dependency in self._formulas[name].dependencies:
+            dependents = self._dependents[dependency]
+            dependents.discard(name)
+            if not dependents:
+                del self._dependents[dependency]
+
+    def _check_cycle(self, name, dependencies):
+        # Цикл появляется, если формула ссылается на имя, которое само
+        # зависит от нее. Ищем такие имена среди зависящих от формулы, поэтому
+        # для нового имени проверка ничего не стоит
+        targets = set(dependencies)
+        parents = {name: None}
+        pending = [name]
+        while pending:
+            current = pending.pop()
+            if current in targets:
+                path = [name, current]
+                while current != name:
+                    current = parents[current]
+                    path.append(current)
+                raise ValueError(f"Циклическая ссылка: {' -> '.join(path)}")
+            for dependent in self._dependents.get(current, ()):
+                if dependent not in parents:
+                    parents[dependent] = current
+                    pending.append(dependent)
+
+    def _invalidate(self, name):
+        # Отмечаем формулу и все зависящие от имени формулы
+        pending = [name] if name in self._formulas else []
+        pending.extend(self._dependents.get(name, ()))
+        dirty = self._dirty
+        while pending:
+            current = pending.pop()
+            if current in dirty:
+                continue
+            dirty.add(current)
+            pending.extend(self._dependents.get(current, ()))
+
+    def recalculate(self):
+        # Пересчитываем отмеченные формулы в топологическом порядке и
+        # возвращаем их число. Время пропорционально числу отмеченных формул
+        # и их связей, остальная книга не просматривается
+        dirty = self._dirty
+        if not dirty:
+            return 0
+        waiting = {}
+        ready = []
+        for name in dirty:
+            count = sum(dependency in dirty for dependency in self._formulas[name].dependencies)
+            if count:
+                waiting[name] = count
+            else:
+                ready.append(name)
+        while ready:
+            name = ready.pop()
+            self._values[name] = self._compute(self._formulas[name])
+            for dependent in self._dependents.get(name, ()):
+                if dependent in waiting:
+                    waiting[dependent] -= 1
+                    if not waiting[dependent]:
+                        del waiting[dependent]
+                        ready.append(dependent)
+        count = len(dirty)
+        dirty.clear()
+        return count
+
+    def _compute(self, formula):
+        arguments = []
+        for dependency in formula.dependencies:
+            if dependency in self._inputs:
+                arguments.append(self._inputs[dependency])
+            elif dependency in self._values:
+                value = self._values[dependency]
+                if isinstance(value, Exception):
+                    return value
+                arguments.append(value)
+            else:
+                return ValueError(f"Неизвестная константа: {dependency}")
+        try:
+            if formula.compiled is None:
+                formula.evaluations += 1
+                if formula.evaluations <= COMPILE_AFTER:
+                    variables = dict(zip(formula.dependencies, arguments))
+                    return calc_core.calculate(formula.tree, self.angle_unit, variables)
+                formula.compiled = calc_core.compile_expression(formula.tree, self.angle_unit, formula.dependencies)
+            return formula.compiled(*arguments)
+        except Exception as e:
+            return e
+
+    def __getitem__(self, name):
+        if name in self._inputs:
+            return self._inputs[name]
+        if name not in self._formulas:
+            raise KeyError(name)
+        if self._dirty:
+            self.recalculate()
+        value = self._values[name]
+        if isinstance(value, Exception):
+            raise _error(value)
+        return value
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
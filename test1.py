@@ -1,9 +1,35 @@
 import unittest
 from prettytable import PrettyTable
-from calc import calculate, parse, evaluate
+from calc import calculate, parse, evaluate, compile_expression, calculate_batch
+from calc import configure_cache, cache_info, cache_clear, optimize, run_batch, calculate_many
+from calc import configure_limits, Evaluator, try_calculate, validate
+import calc
+import calc_server
+import calc_bench
+import calc_library
+import calc_workbook
+import calc_autodiff
+import calc_sample
 import ast
 import math
+import array
+import io
+import json
+import os
+import subprocess
+import asyncio
+import threading
+import itertools
 import time
+import tempfile
+import socket
+import struct
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 def parse_tree_string(tree_str):
     # Преобразуем строку с деревом выражений Add(2, 2) в AST.
@@ -83,8 +109,19 @@ def parse_argument(arg_str):
         return parse_tree_string(arg_str)
 
 def ast_to_str(node):
-    # Преобразуем дерево AST в строковое представление.
-    if isinstance(node, ast.Expression):
+    # Преобразуем дерево AST или дерево калькулятора в строковое представление.
+    if isinstance(node, calc.Number):
+        return str(node.value)
+    elif isinstance(node, calc.BinOp):
+        return f"{node.op.__name__}({ast_to_str(node.left)}, {ast_to_str(node.right)})"
+    elif isinstance(node, calc.UnaryOp):
+        return f"{node.op.__name__}({ast_to_str(node.operand)})"
+    elif isinstance(node, calc.Name):
+        return node.id
+    elif isinstance(node, calc.Call):
+        args = ", ".join(ast_to_str(arg) for arg in node.args)
+        return f"{node.func}({args})"
+    elif isinstance(node, ast.Expression):
         return ast_to_str(node.body)
     elif isinstance(node, ast.BinOp):
         left = ast_to_str(node.left)
@@ -134,6 +171,12 @@ class TestParser(unittest.TestCase):
             ("sqrt(4)", "sqrt(4)"),  
             ("sin(pi/2)", "sin(Div(pi, 2))"),  
             ("ln(e^2)", "ln(Pow(e, 2))"),
+            ("-2^2", "USub(Pow(2, 2))"),
+            ("2^3^2", "Pow(2, Pow(3, 2))"),
+            ("2^-1", "Pow(2, USub(1))"),
+            ("8 - 4 - 2", "Sub(Sub(8, 4), 2)"),
+            ("-2 * 3", "Mult(USub(2), 3)"),
+            (".5 + 5.", "Add(0.5, 5.0)"),
         ]
 
         # Тесты на корректные выражения
@@ -152,6 +195,10 @@ class TestParser(unittest.TestCase):
         error_cases = [
             ("a", "ValueError", "Некорректное выражение: Выражение содержит неверные символы"),
             ("2 /", "ValueError", "Некорректное выражение: Неполное выражение"),
+            ("sinx(1)", "ValueError", "Некорректное выражение: Выражение содержит неверные символы: sinx"),
+            ("2 $ 3", "ValueError", "Некорректное выражение: Выражение содержит неверные символы: $"),
+            ("(1 + 2", "ValueError", "Некорректное выражение: '(' was never closed"),
+            ("1 + 2)", "ValueError", "Некорректное выражение: unmatched ')'"),
         ]
 
         for expression, error_type, error_msg in error_cases:
@@ -316,27 +363,1393 @@ class TestAngleUnits(unittest.TestCase):
         print("\nТесты для единиц измерения углов:")
         print(table)
 
-class TestTime(unittest.TestCase):
-    def test(self):
+class TestCompile(unittest.TestCase):
+    def test_compile(self):
+        table = PrettyTable()
+        table.field_names = [
+            "Выражение",
+            "Результат calculate()",
+            "Результат compile_expression()",
+            "Единицы измерения",
+            "Статус"
+        ]
+        table.align = "l"
+
         test_cases = [
-            ("1+" * 199 + "1"),
-            ("2*2/10+" * 250),
-            ("2*sin(pi/4)+" * 300 + "10"),
+            ("1 + 1", 'radian'),
+            ("2 ^ 3", 'radian'),
+            ("-2 ^ 2", 'radian'),
+            ("2 + (3 * 4)", 'radian'),
+            ("3.375e+09^(1/3)", 'radian'),
+            ("sqrt(2^2 * 2 + 1)", 'radian'),
+            ("ln(e^2)", 'radian'),
+            ("sin(pi/2)", 'radian'),
+            ("sin(90)", 'degree'),
+            ("ctg(45)", 'degree'),
+            ("2*sin(pi/4)+" * 30 + "10", 'radian'),
         ]
-        print("\nНагрузочные тесты:\n")
-        for expression in test_cases:
+
+        for expression, unit in test_cases:
+            with self.subTest(expression=expression, unit=unit):
+                expected = calculate(expression, angle_unit=unit)
+                compiled = compile_expression(expression, angle_unit=unit)
+                result = compiled()
+                status = "Тест пройден" if result == expected else "Тест не пройден"
+                table.add_row([expression, expected, result, unit, status])
+                self.assertEqual(result, expected)
+                self.assertEqual(type(result), type(expected))
+                self.assertEqual(compiled(), expected)
+
+        error_cases = [
+            ("1 / 0", ZeroDivisionError, "Деление на ноль."),
+            ("ctg(0)", ZeroDivisionError, "Деление на ноль."),
+            ("1e300 / 1e-300", OverflowError, "Арифметическое переполнение."),
+            ("exp(1000)", OverflowError, "Арифметическое переполнение."),
+            ("sqrt(0 - 1)", ValueError, "Ошибка в функции sqrt: math domain error"),
+            ("sinx(1)", ValueError, "Некорректное выражение: Выражение содержит неверные символы: sinx"),
+            ("sin(1, 2)", ValueError, "Функция sin принимает ровно 1 аргумент"),
+            ("a + 1", ValueError, "Некорректное выражение: Выражение содержит неверные символы"),
+        ]
+
+        for expression, error_type, error_msg in error_cases:
+            with self.subTest(expression=expression):
+                with self.assertRaises(error_type) as context:
+                    compile_expression(expression)()
+                actual_error = str(context.exception)
+                status = "Тест пройден" if error_msg in actual_error else "Тест не пройден"
+                table.add_row([expression, error_msg, actual_error, 'radian', status])
+                self.assertIn(error_msg, actual_error)
+
+        # Первое вычисление (обход дерева) и повторное (компиляция) сообщают
+        # одну и ту же ошибку: аргументы проверяются раньше функции
+        for expression, error_msg in [
+            ("x(sin)", "Неизвестная константа: sin"),
+            ("x(sin(1, 2))", "Функция sin принимает ровно 1 аргумент"),
+            ("sin(1, x(pi))", "Неизвестная функция: x"),
+        ]:
+            with self.subTest(expression=expression):
+                messages = []
+                for _ in range(3):
+                    with self.assertRaises(ValueError) as context:
+                        calculate(expression, variables={'x': 2})
+                    messages.append(str(context.exception))
+                self.assertEqual(messages, [error_msg] * 3)
+
+        print("\nТесты для компиляции выражений:")
+        print(table)
+
+class TestVariables(unittest.TestCase):
+    def test_variables(self):
+        table = PrettyTable()
+        table.field_names = [
+            "Выражение",
+            "Переменные",
+            "Ожидаемый результат",
+            "Полученный результат",
+            "Статус"
+        ]
+        table.align = "l"
+
+        test_cases = [
+            ("sqrt(x^2 + y^2)", {'x': 3, 'y': 4}, 5),
+            ("x * pi", {'x': 2}, 2 * math.pi),
+            ("ln(x) + exp(y)", {'x': math.e, 'y': 0}, 2),
+            ("-x ^ 2", {'x': 3}, -9),
+        ]
+
+        for expression, variables, expected in test_cases:
+            with self.subTest(expression=expression):
+                result = calculate(expression, variables=variables)
+                compiled = compile_expression(expression, variables=tuple(variables))
+                status = "Тест пройден" if abs(result - expected) < 1e-6 else "Тест не пройден"
+                table.add_row([expression, variables, expected, result, status])
+                self.assertAlmostEqual(result, expected, places=6)
+                self.assertEqual(compiled(*variables.values()), result)
+
+        error_cases = [
+            ("x + 1", {}, "Некорректное выражение: Выражение содержит неверные символы: x"),
+            ("e + 1", {'e': 1}, "Некорректное выражение: Недопустимое имя переменной: e"),
+            ("1 / x", {'x': 0}, "Деление на ноль."),
+        ]
+
+        for expression, variables, error_msg in error_cases:
+            with self.subTest(expression=expression):
+                with self.assertRaises(Exception) as context:
+                    calculate(expression, variables=variables)
+                actual_error = str(context.exception)
+                status = "Тест пройден" if error_msg in actual_error else "Тест не пройден"
+                table.add_row([expression, variables, error_msg, actual_error, status])
+                self.assertIn(error_msg, actual_error)
+
+        print("\nТесты для переменных:")
+        print(table)
+
+@unittest.skipUnless(numpy, "требуется numpy")
+class TestBatch(unittest.TestCase):
+    def test_batch(self):
+        table = PrettyTable()
+        table.field_names = [
+            "Выражение",
+            "Единицы измерения",
+            "Значения x",
+            "Полученный результат",
+            "Статус"
+        ]
+        table.align = "l"
+
+        test_cases = [
+            ("sqrt(x^2 + 16)", 'radian', [3, 0, -3]),
+            ("sin(x) + cos(x)", 'degree', [0, 30, 90, 180]),
+            ("tg(x) * ctg(x)", 'radian', [0.5, 1, 2]),
+            ("x^(1/2) + ln(x) - exp(x / 10)", 'radian', [1, 2.5, 100]),
+        ]
+
+        for expression, unit, xs in test_cases:
+            with self.subTest(expression=expression, unit=unit):
+                result = calculate_batch(expression, angle_unit=unit, x=numpy.array(xs))
+                expected = [calculate(expression, unit, {'x': x}) for x in xs]
+                matched = numpy.allclose(result.values, expected) and not result.mask.any()
+                status = "Тест пройден" if matched else "Тест не пройден"
+                table.add_row([expression, unit, xs, list(result.values), status])
+                self.assertTrue(matched)
+
+        # Ошибки отмечаются в масках по элементам, а не прерывают вычисление
+        xs = array.array('d', [2, 0, -1, 1e200])
+        result = calculate_batch("1 / x + sqrt(x) + x * x", x=xs)
+        for i, x in enumerate(xs):
+            with self.subTest(x=x):
+                try:
+                    expected = calculate("1 / x + sqrt(x) + x * x", variables={'x': x})
+                    self.assertFalse(result.mask[i])
+                    self.assertAlmostEqual(result.values[i], expected)
+                    table.add_row(["1 / x + sqrt(x) + x * x", 'radian', x, result.values[i], "Тест пройден"])
+                except ZeroDivisionError:
+                    self.assertTrue(result.zero_division[i])
+                except OverflowError:
+                    self.assertTrue(result.overflow[i])
+                except ValueError:
+                    self.assertTrue(result.invalid[i])
+                self.assertEqual(math.isnan(result.values[i]), bool(result.mask[i]))
+
+        # Целое за пределами float - переполнение, а не исключение
+        result = calculate_batch("1 / x + 10 ^ 400 + " + "9" * 400, x=[0.0, 2.0])
+        self.assertEqual((list(result.zero_division), list(result.overflow)), ([True, False], [False, True]))
+        self.assertTrue(numpy.isnan(result.values).all())
+
+        print("\nТесты для векторных вычислений:")
+        print(table)
+
+class TestCache(unittest.TestCase):
+    def setUp(self):
+        cache_clear()
+
+    def tearDown(self):
+        configure_cache(maxsize=256, result_maxsize=0, enabled=True)
+        cache_clear()
+
+    def test_cache(self):
+        table = PrettyTable()
+        table.field_names = [
+            "Сценарий",
+            "Ожидаемая статистика",
+            "Полученная статистика",
+            "Статус"
+        ]
+        table.align = "l"
+
+        def check(name, kind, expected):
+            info = cache_info()[kind]
+            actual = (info.hits, info.misses, info.evictions, info.size)
+            status = "Тест пройден" if actual == expected else "Тест не пройден"
+            table.add_row([name, expected, actual, status])
+            self.assertEqual(actual, expected)
+
+        # Одинаковые после нормализации пробелов выражения разбираются один раз
+        for expression in ["2 * sin(pi/4)", "2*sin(pi/4)", "2  *  sin( pi/4 )"]:
+            self.assertAlmostEqual(calculate(expression), math.sqrt(2))
+        check("Повторы одного выражения", 'expressions', (2, 1, 0, 1))
+
+        calculate("2 * sin(pi/4)", angle_unit='degree')
+        check("Другие единицы измерения", 'expressions', (2, 2, 0, 2))
+
+        # При переполнении вытесняется давно не использованное выражение
+        configure_cache(maxsize=2)
+        calculate("1 + 1")
+        calculate("2 * sin(pi/4)")
+        calculate("1 + 2")
+        check("Вытеснение", 'expressions', (2, 5, 3, 2))
+
+        # Кэш результатов включается отдельно и не используется для переменных
+        configure_cache(result_maxsize=8)
+        for _ in range(3):
+            self.assertEqual(calculate("2 ^ 10"), 1024)
+            self.assertEqual(calculate("x ^ 2", variables={'x': 3}), 9)
+        check("Кэш результатов", 'results', (2, 1, 0, 1))
+
+        # Ошибки не кэшируются и сообщения не меняются
+        for _ in range(2):
+            with self.assertRaises(ZeroDivisionError) as context:
+                calculate("1 / 0")
+            self.assertEqual(str(context.exception), "Деление на ноль.")
+
+        # Нормализация не склеивает число с показателем степени: с кэшем и
+        # без него ошибка одна и та же
+        for expression in ["1e -5", "1E  -2", "2.5e -1", "1e- 5", "1e+ 5"]:
+            with self.subTest(expression=expression):
+                messages = []
+                for enabled in (True, True, False):
+                    configure_cache(enabled=enabled)
+                    with self.assertRaises(ValueError) as context:
+                        calculate(expression)
+                    messages.append(str(context.exception))
+                configure_cache(enabled=True)
+                self.assertEqual(messages, ["Некорректное выражение: Неполное выражение"] * 3)
+        self.assertAlmostEqual(calculate("1e-5 + 2 * e -1"), 1e-5 + 2 * math.e - 1)
+
+        cache_clear()
+        configure_cache(enabled=False)
+        self.assertEqual(calculate("1 + 1"), 2)
+        check("Кэш выключен", 'expressions', (0, 0, 0, 0))
+
+        print("\nТесты для кэша выражений:")
+        print(table)
+
+class TestDeepExpressions(unittest.TestCase):
+    def test_deep_expressions(self):
+        table = PrettyTable()
+        table.field_names = [
+            "Выражение",
+            "Длина",
+            "Ожидаемый результат",
+            "Полученный результат",
+            "Статус"
+        ]
+        table.align = "l"
+
+        n = 100000
+        test_cases = [
+            ("1+" * (n - 1) + "1", n),
+            ("(" * n + "1" + ")" * n, 1),
+            ("-" * (n + 1) + "2", -2),
+            ("2^" * 3 + "1", 16),
+            ("sqrt(" * 1000 + "1" + ")" * 1000, 1),
+            ("x*" * n + "1", 1),
+        ]
+
+        for expression, expected in test_cases:
+            with self.subTest(expression=expression[:20]):
+                variables = {'x': 1} if 'x' in expression else None
+                result = calculate(expression, variables=variables)
+                tree = parse(expression, tuple(variables or ()))
+                status = "Тест пройден" if result == expected else "Тест не пройден"
+                table.add_row([expression[:20] + "...", len(expression), expected, result, status])
+                self.assertEqual(result, expected)
+                self.assertEqual(evaluate(tree, variables=variables), expected)
+                self.assertEqual(compile_expression(tree, variables=tuple(variables or ()))(*(variables or {}).values()), expected)
+
+        error_cases = [
+            ("1+" * n + "1/0", ZeroDivisionError, "Деление на ноль."),
+            ("(" * n + "1", ValueError, "Некорректное выражение: '(' was never closed"),
+            ("1+" * n, ValueError, "Некорректное выражение: Неполное выражение"),
+        ]
+
+        for expression, error_type, error_msg in error_cases:
+            with self.subTest(expression=expression[:20]):
+                with self.assertRaises(error_type) as context:
+                    calculate(expression)
+                actual_error = str(context.exception)
+                status = "Тест пройден" if error_msg in actual_error else "Тест не пройден"
+                table.add_row([expression[:20] + "...", len(expression), error_msg, actual_error, status])
+                self.assertIn(error_msg, actual_error)
+
+        print("\nТесты для глубоких выражений:")
+        print(table)
+
+class TestOptimize(unittest.TestCase):
+    def test_optimize(self):
+        table = PrettyTable()
+        table.field_names = [
+            "Выражение",
+            "Ожидаемое дерево",
+            "Полученное дерево",
+            "Статус"
+        ]
+        table.align = "l"
+
+        test_cases = [
+            ("2*2/10", "0.4"),
+            ("e^2", str(math.e ** 2)),
+            ("2*sin(pi/4)", str(2 * math.sin(math.pi / 4))),
+            ("x*1 + 0", "x"),
+            ("1*x^1 - 0", "x"),
+            ("x*1.0", "Mult(x, 1.0)"),
+            ("1 + 2 + x", "Add(3, x)"),
+            ("x + 1 + 2", "Add(Add(x, 1), 2)"),
+            ("1/0 + x", "Add(Div(1, 0), x)"),
+            ("sqrt(0-1)", "sqrt(-1)"),
+        ]
+
+        for expression, expected in test_cases:
+            with self.subTest(expression=expression):
+                tree = optimize(parse(expression, ('x',)))
+                result = ast_to_str(tree)
+                status = "Тест пройден" if result == expected else "Тест не пройден"
+                table.add_row([expression, expected, result, status])
+                self.assertEqual(result, expected)
+
+        # Одинаковые поддеревья объединяются в один узел
+        tree = optimize(parse("sin(x)*sin(x) + sin(x)", ('x',)))
+        self.assertIs(tree.left.left, tree.left.right)
+        self.assertIs(tree.left.left, tree.right)
+
+        # Упрощение не меняет результаты и ошибки вычислений
+        expressions = [
+            "2*sin(pi/4)+" * 50 + "x",
+            "sin(x)*sin(x) + cos(x)*cos(x) + sin(x)*1",
+            "(x + 1)^1 * (x + 1) + 0",
+            "ln(x) / ln(x)",
+            "1 / (x - x)",
+            "exp(x * 1000)",
+        ]
+        for expression in expressions:
+            for x in [0.5, 2, 0]:
+                with self.subTest(expression=expression, x=x):
+                    try:
+                        expected = evaluate(parse(expression, ('x',)), variables={'x': x})
+                        if math.isinf(expected) or math.isnan(expected):
+                            raise OverflowError("Арифметическое переполнение.")
+                    except Exception as e:
+                        expected = type(e)
+                    try:
+                        result = compile_expression(expression, variables=('x',))(x)
+                    except Exception as e:
+                        result = type(e)
+                    self.assertEqual(result, expected)
+
+        print("\nТесты для упрощения выражений:")
+        print(table)
+
+class TestLimits(unittest.TestCase):
+    def setUp(self):
+        cache_clear()
+
+    def tearDown(self):
+        configure_limits(max_nodes=0, max_int_bits=4096, timeout=0)
+        cache_clear()
+
+    def test_int_size(self):
+        table = PrettyTable()
+        table.field_names = ["Выражение", "Ожидаемый результат", "Результат", "Время, мс", "Статус"]
+        table.align = "l"
+
+        overflow = "Арифметическое переполнение."
+        test_cases = [
+            ("9^9^9", overflow),
+            ("10^10^7", overflow),
+            ("2^2^2^2^2^2", overflow),
+            ("(10^1000)*(10^1000)", overflow),
+            ("2^3000 - 2^3000", 0),
+            ("2^4000 / 2^3999", 2.0),
+            ("3^3000 - 3^3000", overflow),
+            ("2^100", 2 ** 100),
+            ("(-1)^(10^9)", 1),
+            ("1^5000", 1),
+            ("0^(-1)", "Деление на ноль."),
+        ]
+        deep = "(" * 300 + "{}" + ")" * 300
+        for expression, expected in test_cases:
+            # Обход дерева, скомпилированный байткод и программа для глубокого дерева
+            for name, func in [("calculate", lambda: calculate(expression)),
+                               ("compile", lambda: compile_expression(expression)()),
+                               ("deep", lambda: compile_expression(deep.format(expression))()),
+                               ("variables", lambda: compile_expression(expression.replace("9^9^9", "x^x^x"), variables=["x"])(9))]:
+                with self.subTest(expression=expression, path=name):
+                    start = time.perf_counter()
+                    try:
+                        result = func()
+                    except (ValueError, ArithmeticError) as e:
+                        result = str(e)
+                    elapsed = (time.perf_counter() - start) * 1000
+                    status = "Тест пройден" if result == expected and elapsed < 1000 else "Тест не пройден"
+                    table.add_row([f"{expression} ({name})", expected, str(result)[:40], f"{elapsed:.2f}", status])
+                    self.assertEqual(result, expected)
+                    self.assertEqual(type(result), type(expected))
+                    self.assertLess(elapsed, 1000)
+
+        # Меньшее ограничение переводит вычисление в float
+        configure_limits(max_int_bits=64)
+        self.assertEqual(calculate("2^100"), 2.0 ** 100)
+        self.assertEqual(compile_expression("x * x", variables=["x"])(2 ** 40), 2.0 ** 80)
+        self.assertEqual(calculate("2^60"), 2 ** 60)
+
+        print("\nТесты для ограничения размера целых чисел:")
+        print(table)
+
+    def test_nodes_and_time(self):
+        configure_limits(max_nodes=4)
+        self.assertEqual(calculate("sin(1 + 2)"), math.sin(3))
+        for func in [lambda: calculate("1 + 2 + 3"), lambda: parse("-(1) * 2 ^ 3"),
+                     lambda: evaluate(ast.parse("1 + 2 + 3", mode="eval").body),
+                     lambda: compile_expression(parse("1 + 2 + 3"))]:
+            with self.assertRaises(ValueError) as context:
+                func()
+            self.assertTrue(str(context.exception).startswith(
+                "Некорректное выражение: Слишком большое выражение"))
+        configure_limits(max_nodes=0)
+
+        # Новое ограничение действует и на уже кэшированные выражения, а
+        # try_calculate() и validate() считают большое выражение некорректным
+        expression = "+".join(["x"] * 50)
+        evaluator = Evaluator()
+        tree = parse(expression, ['x'])
+        for _ in range(3):
+            self.assertEqual(calculate(expression, variables={'x': 1}), 50)
+            self.assertEqual(evaluator.calculate(expression, {'x': 1}), 50)
+            self.assertEqual(try_calculate(expression, variables={'x': 1}).value, 50)
+        configure_limits(max_nodes=10)
+        try:
+            message = "Некорректное выражение: Слишком большое выражение: 99 узлов, допустимо 10"
+            for func in [lambda: calculate(expression, variables={'x': 1}),
+                         lambda: evaluator.calculate(expression, {'x': 1}),
+                         lambda: evaluate(tree, variables={'x': 1}),
+                         lambda: compile_expression(tree, variables=['x'])]:
+                with self.assertRaises(ValueError) as context:
+                    func()
+                self.assertEqual(str(context.exception), message)
+            self.assertEqual(try_calculate(expression, variables={'x': 1}), (calc.INVALID, None, message))
+            self.assertEqual(validate(expression, ['x']), (calc.INVALID, None, message))
+            configure_cache(enabled=False)
+            self.assertEqual(try_calculate(expression, variables={'x': 1}), (calc.INVALID, None, message))
+        finally:
+            configure_cache(enabled=True)
+            configure_limits(max_nodes=0)
+
+        tree = parse("1+" * 20000 + "1")
+        configure_limits(timeout=1e-6)
+        for func in [lambda: evaluate(tree), lambda: calculate(tree),
+                     compile_expression("-x+" * 20000 + "1", variables=["x"])]:
+            with self.assertRaises(TimeoutError) as context:
+                func() if func.__name__ == "<lambda>" else func(1)
+            self.assertEqual(str(context.exception), "Превышено время вычисления.")
+        configure_limits(timeout=0)
+        self.assertEqual(evaluate(tree), 20001)
+
+        # Широкое неглубокое дерево: повторные вычисления (скомпилированной
+        # функцией) тоже проверяют время
+        for leaf, variables in [("x", {'x': 1}), ("1", None)]:
+            parts = [leaf] * 4096
+            while len(parts) > 1:
+                parts = [f"({parts[i]} + {parts[i + 1]})" for i in range(0, len(parts), 2)]
+            expression = parts[0]
+            evaluator = Evaluator()
+            configure_limits(timeout=1e-6)
+            try:
+                for func in [lambda: calculate(expression, variables=variables),
+                             lambda: evaluator.calculate(expression, variables),
+                             lambda: compile_expression(expression, variables=tuple(variables or ()))(
+                                 *(variables or {}).values())]:
+                    for _ in range(3):
+                        with self.assertRaises(TimeoutError):
+                            func()
+                    self.assertEqual(try_calculate(expression, variables=variables).status, calc.TIMEOUT)
+            finally:
+                configure_limits(timeout=0)
+            self.assertEqual(calculate(expression, variables=variables), 4096)
+
+class TestLibrary(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "formulas.calclib")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_library(self):
+        table = PrettyTable()
+        table.field_names = ["Формула", "Значения", "Ожидаемый результат", "Результат", "Статус"]
+        table.align = "l"
+
+        formulas = {
+            "area": ("pi * r^2", ["r"]),
+            "hypot": ("sqrt(a^2 + b^2)", ["a", "b"]),
+            "mixed": ("2 * x * 3 + sin(x) * sin(x) - 1 / (x + 1)", ["x"]),
+            "power": ("2^10 + 2^0.5", []),
+            "big": ("2^100 + 1", []),
+            "huge": ("9^9^9", []),
+            "deep": ("(" * 300 + "x" + ") * 2" * 300, ["x"]),
+            "сумма": ("x + y", ["x", "y"]),
+            "ctg": "ctg(0)",
+        }
+        test_cases = [
+            ("area", (2,), 4 * math.pi),
+            ("hypot", (3, 4), 5.0),
+            ("mixed", (0.5,), calculate("2 * x * 3 + sin(x) * sin(x) - 1 / (x + 1)", variables={"x": 0.5})),
+            ("mixed", (-1,), "Деление на ноль."),
+            ("power", (), 1024 + 2 ** 0.5),
+            ("big", (), 2 ** 100 + 1),
+            ("huge", (), "Арифметическое переполнение."),
+            ("deep", (1,), 2 ** 300),
+            ("сумма", (2, 3), 5),
+            ("ctg", (), "Деление на ноль."),
+        ]
+        calc_library.write_library(self.path, formulas)
+        with calc_library.Library(self.path) as library:
+            self.assertEqual(len(library), len(formulas))
+            self.assertEqual(list(library), sorted(formulas, key=lambda name: name.encode("utf-8")))
+            self.assertEqual(library._compiled, {})
+            for name, values, expected in test_cases:
+                with self.subTest(name=name, values=values):
+                    try:
+                        result = library[name](*values)
+                    except (ValueError, ArithmeticError) as e:
+                        result = str(e)
+                    status = "Тест пройден" if result == expected else "Тест не пройден"
+                    table.add_row([name, values, expected, result, status])
+                    self.assertEqual(result, expected)
+                    self.assertEqual(type(result), type(expected))
+
+            self.assertEqual(library.formula("hypot"), ("sqrt(a^2 + b^2)", ("a", "b"), "radian"))
+            self.assertIn("area", library)
+            self.assertNotIn("volume", library)
+            self.assertIsNone(library.get("volume"))
+            with self.assertRaises(KeyError):
+                library["volume"]
+            self.assertIs(library["area"], library["area"])
+
+        calc_library.write_library(self.path, {"s": ("sin(x)", ["x"])}, 'degree')
+        with calc_library.Library(self.path) as library:
+            self.assertAlmostEqual(library["s"](90), 1.0)
+
+        with self.assertRaises(ValueError) as context:
+            calc_library.write_library(self.path, {"bad": "2 +"})
+        self.assertEqual(str(context.exception), "Формула bad: Некорректное выражение: Неполное выражение")
+
+        print("\nТесты для библиотеки формул:")
+        print(table)
+
+    def test_damaged(self):
+        calc_library.write_library(self.path, {f"f{i}": f"{i} * 2" for i in range(100)})
+        with open(self.path, "rb") as file:
+            data = bytearray(file.read())
+
+        test_cases = [
+            (lambda data: data[:10], "Неверный формат библиотеки формул"),
+            (lambda data: b"NOTALIB!" + data[8:], "Неверный формат библиотеки формул"),
+            (lambda data: data[:8] + b"\x02" + data[9:], "Неподдерживаемая версия библиотеки формул: 2"),
+            (lambda data: data[:-3] + b"777", "Контрольная сумма библиотеки формул не совпадает"),
+        ]
+        for damage, message in test_cases:
+            with self.subTest(message=message):
+                with open(self.path, "wb") as file:
+                    file.write(damage(bytes(data)))
+                with self.assertRaises(ValueError) as context:
+                    calc_library.Library(self.path)
+                self.assertEqual(str(context.exception), message)
+
+    def test_load_time(self):
+        # Загрузка не декодирует формулы, поэтому не зависит от их числа
+        formulas = {f"f{i}": (f"{i} * x + {i % 7}", ["x"]) for i in range(5000)}
+        calc_library.write_library(self.path, formulas)
+        start = time.perf_counter()
+        with calc_library.Library(self.path) as library:
+            self.assertEqual(library["f4321"](2), 4321 * 2 + 4321 % 7)
+        self.assertLess(time.perf_counter() - start, 0.05)
+
+class TestWorkbook(unittest.TestCase):
+    def test_workbook(self):
+        table = PrettyTable()
+        table.field_names = ["Изменение", "Пересчитано", "Значения", "Статус"]
+        table.align = "l"
+
+        book = calc_workbook.Workbook()
+        book.update({"price": 100, "count": 3})
+        book.define("total", "price * count * (1 - discount)")
+        book.define("discount", "0.1")
+        book.define("tax", "total * rate")
+        book.define("label", "count + 1")
+        self.assertEqual(book.dependencies("total"), ("price", "count", "discount"))
+        self.assertEqual(book.dependents("count"), {"total", "label"})
+
+        names = ["total", "tax", "label"]
+        test_cases = [
+            (lambda: None, 4, [270.0, "Неизвестная константа: rate", 4]),
+            (lambda: book.set("rate", 0.2), 1, [270.0, 54.0, 4]),
+            (lambda: book.set("price", 200), 2, [540.0, 108.0, 4]),
+            (lambda: book.set("count", 0), 3, [0.0, 0.0, 1]),
+            (lambda: book.define("discount", "1 / count"), 3, ["Деление на ноль."] * 2 + [1]),
+            (lambda: book.set("count", 2), 4, [200.0, 40.0, 3]),
+            (lambda: book.delete("rate"), 1, [200.0, "Неизвестная константа: rate", 3]),
+        ]
+        for i, (change, recalculated, expected) in enumerate(test_cases):
+            with self.subTest(step=i):
+                change()
+                count = book.recalculate()
+                result = []
+                for name in names:
+                    try:
+                        result.append(book[name])
+                    except (ValueError, ArithmeticError) as e:
+                        result.append(str(e))
+                status = "Тест пройден" if (count, result) == (recalculated, expected) else "Тест не пройден"
+                table.add_row([i, count, result, status])
+                self.assertEqual(result, expected)
+                self.assertEqual(count, recalculated)
+
+        book.define("angle", "sin(count * 45)")
+        self.assertAlmostEqual(book["angle"], math.sin(90))
+        degrees = calc_workbook.Workbook('degree')
+        degrees.set("x", 90)
+        degrees.define("s", "sin(x)")
+        self.assertEqual(degrees["s"], 1.0)
+
+        print("\nТесты для книги формул:")
+        print(table)
+
+    def test_cycles(self):
+        book = calc_workbook.Workbook()
+        book.set("x", 1)
+        book.define("a", "x + 1")
+        book.define("b", "a * 2")
+        book.define("c", "b + a")
+        for name, expression, message in [
+            ("a", "c + 1", "Циклическая ссылка: a -> c -> b -> a"),
+            ("x", "c", "Циклическая ссылка: x -> c -> a -> x"),
+            ("d", "d", "Циклическая ссылка: d -> d"),
+        ]:
+            with self.subTest(name=name):
+                with self.assertRaises(ValueError) as context:
+                    book.define(name, expression)
+                self.assertIn(str(context.exception), [message, message.replace("c -> b -> a", "c -> a")])
+        # Неудачное определение не меняет книгу
+        self.assertEqual((book["x"], book["c"], book.expression("a")), (1, 6, "x + 1"))
+        with self.assertRaises(ValueError):
+            book.define("e", "2 +")
+        self.assertNotIn("e", book)
+        with self.assertRaises(ValueError) as context:
+            book.define("f", "x $ 2")
+        self.assertEqual(str(context.exception), "Некорректное выражение: Выражение содержит неверные символы: $")
+
+        # Значение вместо формулы убирает формулу целиком, и имя можно
+        # снова сделать формулой
+        book.set("a", 5)
+        self.assertEqual((len(book), list(book)), (4, ["x", "a", "b", "c"]))
+        self.assertEqual((book["b"], book["c"]), (10, 15))
+        self.assertEqual(book.dependents("x"), frozenset())
+        book.define("a", "x * 3")
+        book.set("x", 2)
+        self.assertEqual((len(book), book["c"]), (4, 18))
+
+    def test_incremental(self):
+        # Изменение входа пересчитывает только зависящую от него часть книги
+        book = calc_workbook.Workbook()
+        book.update({"a": 1, "b": 1})
+        book.define("c0", "a")
+        for i in range(1, 20000):
+            book.define(f"c{i}", f"c{i - 1} + 1")
+        book.define("d0", "b * 2")
+        book.define("d1", "d0 + c0")
+        self.assertEqual(book["c19999"], 20000)
+        for value in range(2, 2 + 2 * calc_workbook.COMPILE_AFTER):
+            book.set("b", value)
+            self.assertEqual(book.recalculate(), 2)
+            self.assertEqual(book["d1"], value * 2 + 1)
+        book.set("a", 5)
+        self.assertEqual(book.recalculate(), 20001)
+        self.assertEqual(book["c19999"], 20004)
+
+class TestAutodiff(unittest.TestCase):
+    @staticmethod
+    def difference(expression, unit, variables, name, h=1e-6):
+        # Центральная разностная производная для сравнения
+        shifted = [dict(variables, **{name: variables[name] + step}) for step in (h, -h)]
+        return (calculate(expression, unit, shifted[0]) - calculate(expression, unit, shifted[1])) / (2 * h)
+
+    def test_gradient(self):
+        table = PrettyTable()
+        table.field_names = ["Выражение", "Единицы измерения", "Точка", "Градиент", "Статус"]
+        table.align = "l"
+
+        test_cases = [
+            ("x^2 * y - x / y + 3", 'radian', {'x': 1.5, 'y': -2}),
+            ("sqrt(x) + ln(x) + exp(-x)", 'radian', {'x': 2}),
+            ("sin(x) * cos(y) + tg(x * y) - ctg(y)", 'radian', {'x': 0.3, 'y': 1.1}),
+            ("sin(x) + cos(x) + tg(x) + ctg(x)", 'degree', {'x': 30}),
+            ("x^y + 2^x + x^3", 'radian', {'x': 1.7, 'y': 2.5}),
+            ("-(x - y)^2 / (1 + pi * z)", 'radian', {'x': 1, 'y': 4, 'z': 0.5}),
+            ("sin(ln(x))^2 + exp(sqrt(x))", 'degree', {'x': 3}),
+        ]
+
+        for expression, unit, point in test_cases:
+            with self.subTest(expression=expression, unit=unit):
+                result = calc_autodiff.gradient(expression, unit, point)
+                self.assertEqual(result.value, calculate(expression, unit, point))
+                self.assertEqual(list(result.gradient), list(point))
+                matched = all(math.isclose(result.gradient[name], self.difference(expression, unit, point, name),
+                                           rel_tol=1e-6, abs_tol=1e-6) for name in point)
+                status = "Тест пройден" if matched else "Тест не пройден"
+                table.add_row([expression, unit, point, result.gradient, status])
+                self.assertTrue(matched)
+
+        # Выражение без переменных и переменная, не входящая в выражение
+        self.assertEqual(calc_autodiff.gradient("2 + 3"), (5, {}))
+        self.assertEqual(calc_autodiff.gradient("x * 2", variables={'x': 1, 'y': 2}).gradient, {'x': 2.0, 'y': 0.0})
+
+        print("\nТесты для производных:")
+        print(table)
+
+    def test_errors(self):
+        test_cases = [
+            ("1 / (x - 1)", {'x': 1}, ZeroDivisionError, "Деление на ноль."),
+            ("ln(x)", {'x': -1}, ValueError, "Ошибка в функции ln: math domain error"),
+            ("sqrt(x)", {'x': 0}, OverflowError, "Арифметическое переполнение."),
+            ("x^0.5", {'x': 0}, OverflowError, "Арифметическое переполнение."),
+            ("exp(x)", {'x': 1000}, OverflowError, "Арифметическое переполнение."),
+            ("x^y", {'x': -2, 'y': 2}, ValueError,
+             "Производная степени по показателю не определена при отрицательном основании"),
+            ("x +", {'x': 1}, ValueError, "Некорректное выражение: Неполное выражение"),
+        ]
+        for expression, point, error, message in test_cases:
+            with self.subTest(expression=expression):
+                with self.assertRaises(error) as context:
+                    calc_autodiff.gradient(expression, variables=point)
+                self.assertEqual(str(context.exception), message)
+        # Производная по основанию в нуле при постоянном показателе определена
+        self.assertEqual(calc_autodiff.gradient("x^2 + x^y", variables={'x': 0, 'y': 3}).gradient,
+                         {'x': 0.0, 'y': 0.0})
+
+    @unittest.skipUnless(numpy, "требуется numpy")
+    def test_batch(self):
+        for expression, unit in [("x^2 * y + sin(x) - ctg(y) / x", 'radian'),
+                                 ("tg(x) + sqrt(y) * cos(x * y)", 'degree')]:
+            with self.subTest(expression=expression, unit=unit):
+                xs = numpy.linspace(0.5, 3, 7)
+                result = calc_autodiff.gradient_batch(expression, unit, x=xs, y=0.7)
+                self.assertFalse(result.value.mask.any())
+                for i, x in enumerate(xs):
+                    expected = calc_autodiff.gradient(expression, unit, {'x': x, 'y': 0.7})
+                    self.assertAlmostEqual(result.value.values[i], expected.value)
+                    for name in ('x', 'y'):
+                        self.assertAlmostEqual(result.gradient[name][i], expected.gradient[name])
+
+        # Ошибки значения и производной отмечаются в масках, элементы равны nan
+        result = calc_autodiff.gradient_batch("sqrt(x) + 1 / x", x=[0, 1, -1, 4])
+        self.assertEqual(list(result.value.zero_division), [True, False, False, False])
+        self.assertEqual(list(result.value.invalid), [False, False, True, False])
+        self.assertEqual(list(numpy.isnan(result.gradient['x'])), [True, False, True, False])
+        self.assertEqual(list(result.gradient['x'][[1, 3]]), [-0.5, 0.1875])
+        result = calc_autodiff.gradient_batch("sqrt(x)", x=[0, 1])
+        self.assertEqual(list(result.value.overflow), [True, False])
+        result = calc_autodiff.gradient_batch("x + " + "9" * 400, x=[0, 1])
+        self.assertEqual(list(result.value.overflow), [True, True])
+        self.assertTrue(numpy.isnan(result.gradient['x']).all())
+        with self.assertRaises(OverflowError):
+            calc_autodiff.gradient("x + " + "9" * 400, variables={'x': 1})
+
+        # Деление на разность констант отмечается в маске, как в calculate_batch()
+        for expression in ["x / (pi - pi)", "sqrt(cos(x / (e - e)))"]:
+            with self.subTest(expression=expression):
+                result = calc_autodiff.gradient_batch(expression, x=[1.0, 2.0])
+                expected = calculate_batch(expression, x=[1.0, 2.0])
+                self.assertEqual(list(result.value.zero_division), list(expected.zero_division))
+                self.assertEqual(list(result.value.zero_division), [True, True])
+                self.assertTrue(numpy.isnan(result.gradient['x']).all())
+
+class TestSample(unittest.TestCase):
+    def test_grid(self):
+        table = PrettyTable()
+        table.field_names = ["Выражение", "Сетка", "Точки", "Статус"]
+        table.align = "l"
+
+        test_cases = [
+            ("x^2 - 1", ("x", 0, 1), {'num': 5}, [0.0, 0.25, 0.5, 0.75, 1.0]),
+            ("x + a", ("x", 1, 0), {'step': 0.25, 'variables': {'a': 10}}, [1, 0.75, 0.5, 0.25, 0.0]),
+            ("sin(x)", ("x", 0, 90), {'step': 30, 'angle_unit': 'degree'}, [0, 30, 60, 90]),
+            ("x * y", (["x", "y"], 0, [1, 2]), {'num': [2, 3]},
+             [(0.0, 0.0), (0.0, 1.0), (0.0, 2.0), (1.0, 0.0), (1.0, 1.0), (1.0, 2.0)]),
+            ("x - y + z", (["x", "y", "z"], 0, 1), {'num': 2}, list(itertools.product([0.0, 1.0], repeat=3))),
+        ]
+        for expression, grid, options, expected in test_cases:
+            with self.subTest(expression=expression, grid=grid):
+                result = list(calc_sample.sample(expression, *grid, **options))
+                names = (grid[0],) if isinstance(grid[0], str) else grid[0]
+                values = [calculate(expression, options.get('angle_unit', 'radian'),
+                                    dict(options.get('variables', {}),
+                                         **dict(zip(names, point if isinstance(point, tuple) else (point,)))))
+                          for point in expected]
+                matched = ([point for point, _ in result] == expected and
+                           all(math.isclose(a, b, abs_tol=1e-12) for (_, a), b in zip(result, values)))
+                status = "Тест пройден" if matched else "Тест не пройден"
+                table.add_row([expression, grid, len(result), status])
+                self.assertTrue(matched)
+
+        # Ошибка в точке возвращается на месте значения и не прерывает сетку
+        result = list(calc_sample.sample("1 / x", "x", -1, 1, num=3))
+        self.assertEqual([result[0], result[2]], [(-1.0, -1.0), (1.0, 1.0)])
+        self.assertIsInstance(result[1][1], ZeroDivisionError)
+        self.assertEqual(str(result[1][1]), "Деление на ноль.")
+
+        for args, options in [(("x", 0, 1), {'step': 0}), (("x", 0, 1), {'num': 0}),
+                              ((["x", "y"], 0, [1, 2, 3]), {}), (("x +", "x", 0, 1), {}),
+                              ((["x", "y"], 0, 1), {'adaptive': True})]:
+            with self.subTest(args=args, options=options):
+                with self.assertRaises(ValueError):
+                    expression = "x" if len(args) == 3 else args[0]
+                    calc_sample.sample(expression, *args[-3:], **options)
+
+        # Точки вычисляются по мере перебора, огромная сетка не хранится в памяти
+        points = calc_sample.sample("x", "x", 0, 1e15, num=10 ** 15 + 1)
+        self.assertEqual(list(itertools.islice(points, 3)), [(0.0, 0.0), (1.0, 1.0), (2.0, 2.0)])
+
+        print("\nТесты для вычисления на сетке:")
+        print(table)
+
+    def test_adaptive(self):
+        # Точки сгущаются у полюса tg и у границы области определения ln
+        for expression, start, stop, feature in [("tg(x)", 0, 3, math.pi / 2), ("ln(x)", 0, 1, 0),
+                                                 ("ctg(x)", 1, 359, 180)]:
+            with self.subTest(expression=expression):
+                unit = 'degree' if expression == "ctg(x)" else 'radian'
+                result = list(calc_sample.sample(expression, "x", start, stop, num=11, adaptive=True,
+                                                 angle_unit=unit))
+                xs = [x for x, _ in result]
+                self.assertEqual(xs, sorted(set(xs)))
+                self.assertEqual((xs[0], xs[-1]), (start, stop))
+                step = (stop - start) / 10
+                near = sum(abs(x - feature) < step / 4 for x in xs)
+                self.assertGreater(near, len(xs) / 4)
+                self.assertLess(min(abs(x - feature) for x in xs if x != feature), step / 100)
+
+        # Для той же точности линейной интерполяции адаптивной сетке нужно
+        # меньше вычислений, чем равномерной
+        def interpolation_error(points):
+            worst = 0
+            for (a, fa), (b, fb) in zip(points, points[1:]):
+                for k in range(1, 8):
+                    x = a + (b - a) * k / 8
+                    worst = max(worst, abs(math.sin(10 * x) * math.exp(-x) - fa - (fb - fa) * k / 8))
+            return worst
+
+        expression = "sin(10 * x) * exp(-x)"
+        adaptive = list(calc_sample.sample(expression, "x", 0, 5, num=33, adaptive=True))
+        uniform = list(calc_sample.sample(expression, "x", 0, 5, num=len(adaptive)))
+        self.assertLess(interpolation_error(adaptive), interpolation_error(uniform) / 2)
+        self.assertLess(interpolation_error(adaptive), 1e-3)
+
+        # Переменная, заданная списком из одного имени: те же точки, x - кортеж
+        listed = list(calc_sample.sample(expression, ["x"], [0], [5], num=33, adaptive=True))
+        self.assertEqual(listed, [((x,), value) for x, value in adaptive])
+
+    def test_command_line(self):
+        process = subprocess.run(
+            [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "calc.py"),
+             "sample", "1 / x + a", "--range", "x", "-1", "1", "--num", "3", "--set", "a=2"],
+            capture_output=True, text=True, encoding="utf-8")
+        self.assertEqual(process.stdout.splitlines(), ["-1.0\t1.0", "0.0\tОшибка: Деление на ноль.", "1.0\t3.0"])
+        self.assertEqual(process.returncode, 1)
+
+class TestEvaluator(unittest.TestCase):
+    def test_evaluator(self):
+        table = PrettyTable()
+        table.field_names = ["Выражение", "Единицы измерения", "calculate()", "Evaluator", "Статус"]
+        table.align = "l"
+
+        def outcome(func):
+            try:
+                return func()
+            except Exception as e:
+                return f"{type(e).__name__}: {e}"
+
+        # Вычислитель по умолчанию ведет себя как calculate(), в том числе
+        # при повторных вычислениях скомпилированной функцией
+        expressions = ["2 + 3 * 4", "sin(pi / 2) + cos(0)", "1 / 0", "2 ^ 10000", "ln(-1)", "2 +",
+                       "-2 ^ 2", "sqrt(16) + ctg(1) * x", "tg(45) + y", "exp(1000)"]
+        for unit in ('radian', 'degree'):
+            evaluator = Evaluator(unit)
+            for expression in expressions:
+                with self.subTest(expression=expression, unit=unit):
+                    variables = {'x': 2, 'y': 0.5}
+                    expected = outcome(lambda: calculate(expression, unit, variables))
+                    results = [outcome(lambda: evaluator.calculate(expression, variables)) for _ in range(3)]
+                    status = "Тест пройден" if results == [expected] * 3 else "Тест не пройден"
+                    table.add_row([expression, unit, expected, results[-1], status])
+                    self.assertEqual(results, [expected] * 3)
+
+        # Свои функции с любым числом аргументов и константы не меняют
+        # ни исходный вычислитель, ни функции модуля
+        base = Evaluator()
+        custom = (base.with_function("hypot", math.hypot, 2)
+                      .with_function("sind", math.sin, angular=True)
+                      .with_function("clamp", lambda x, low, high: min(max(x, low), high), 3)
+                      .with_constant("g", 9.81))
+        test_cases = [
+            ("hypot(3, 4) + g * x", {'x': 2}, 'radian', 5 + 9.81 * 2),
+            ("clamp(x, 0, 1) + clamp(-x, 0, 1)", {'x': 0.25}, 'radian', 0.25),
+            ("sind(90) + sin(90) + hypot(x, sind(30) * 2)", {'x': 0}, 'degree', 3.0),
+            ("sind(pi / 2)", None, 'radian', 1.0),
+        ]
+        for expression, variables, unit, expected in test_cases:
+            with self.subTest(expression=expression, unit=unit):
+                evaluator = custom.with_angle_unit(unit)
+                results = [evaluator.calculate(expression, variables) for _ in range(3)]
+                results.append(evaluator.evaluate(evaluator.parse(expression, tuple(variables or ())), variables))
+                matched = all(math.isclose(result, expected) for result in results)
+                status = "Тест пройден" if matched else "Тест не пройден"
+                table.add_row([expression, unit, "-", results[0], status])
+                self.assertTrue(matched)
+
+        self.assertNotIn("hypot", base.functions)
+        self.assertNotIn("hypot", calc.functions)
+        self.assertNotIn("g", calc.constants)
+        with self.assertRaises(TypeError):
+            custom.functions["hypot"] = None
+        compiled = custom.compile("hypot(x, y) * 2 + clamp(x, y, 10)", ['x', 'y'])
+        self.assertEqual(compiled(3, 4), 14)
+
+        for expression, message in [
+            ("hypot(3)", "Функция hypot принимает ровно 2 аргумента"),
+            ("clamp(1, 2)", "Функция clamp принимает ровно 3 аргумента"),
+            ("sin(1, 2)", "Функция sin принимает ровно 1 аргумент"),
+            ("g(1)", "Неизвестная функция: g"),
+            ("hypot(-1, x)", "Некорректное выражение: Выражение содержит неверные символы: x"),
+        ]:
+            with self.subTest(expression=expression):
+                for attempt in range(2):
+                    with self.assertRaises(ValueError) as context:
+                        custom.calculate(expression)
+                    self.assertEqual(str(context.exception), message)
+        # Имена функций не пересекаются со служебными именами скомпилированной функции
+        clashes = (base.with_function("mul", lambda x: 10 * x).with_function("pow", lambda x: x + 1)
+                       .with_function("v0", lambda x: -x).with_function("t0", lambda x: x / 2))
+        compiled = clashes.compile("mul(x) + x * x + pow(x) + x ^ 2 + v0(x) + t0(sin(x)) * sin(x)", ['x'])
+        self.assertAlmostEqual(compiled(3), 30 + 9 + 4 + 9 - 3 + math.sin(3) ** 2 / 2)
+        for _ in range(3):
+            self.assertEqual(clashes.calculate("mul(x) + x * x + v0(x) + t0(x)", {'x': 2}), 20 + 4 - 2 + 1)
+
+        # Свои функции могут вернуть целое: * и ^ над их значениями и в
+        # скомпилированной функции проверяют размер результата
+        big = base.with_function("big", lambda x: 10 ** int(x)).with_function("sin", lambda x: int(x) * 1000)
+        for expression in ["big(x) ^ big(x)", "big(x) ^ 1000 * big(x) ^ 1000", "sin(x) ^ sin(x)"]:
+            with self.subTest(expression=expression):
+                for _ in range(3):
+                    start = time.perf_counter()
+                    with self.assertRaises(OverflowError):
+                        big.calculate(expression, {'x': 7})
+                    self.assertLess(time.perf_counter() - start, 0.5)
+        self.assertEqual(big.compile("big(x) * big(x)", ['x'])(3), 10 ** 6)
+
+        # Строка в evaluate() разбирается с именами переменных, как в calculate()
+        self.assertEqual(base.evaluate("x + 1", {'x': 1}), 2)
+        self.assertEqual(base.evaluate("2 * pi"), 2 * math.pi)
+
+        for args in [("1x", abs), ("g", abs), ("f", abs, 0), ("f", 1)]:
+            with self.subTest(args=args):
+                with self.assertRaises(ValueError):
+                    custom.with_function(*args)
+        with self.assertRaises(ValueError):
+            Evaluator('grad')
+
+        print("\nТесты для вычислителя с реестром функций:")
+        print(table)
+
+    def test_threads(self):
+        # Вычислители с разными настройками из общего пула потоков
+        from concurrent.futures import ThreadPoolExecutor
+        evaluators = [Evaluator('radian', cache_size=4), Evaluator('degree', cache_size=4),
+                      Evaluator().with_function("twice", lambda x: 2 * x)]
+        tasks = [(i % 3, f"sin(x) + {i % 7} * x" if i % 3 < 2 else f"twice(x) + {i % 7}", i / 10)
+                 for i in range(600)]
+
+        def run(task):
+            which, expression, x = task
+            return evaluators[which].calculate(expression, {'x': x})
+
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(run, tasks))
+        for (which, expression, x), result in zip(tasks, results):
+            unit = 'degree' if which == 1 else 'radian'
+            expected = (2 * x + int(expression[-1]) if which == 2 else calculate(expression, unit, {'x': x}))
+            self.assertAlmostEqual(result, expected)
+
+        report = calc_bench.measure_threads("short", "x * 2 + sin(x)", (1, 2), 200, {'x': 1})
+        self.assertEqual(set(report), {"threads-1/short", "threads-2/short"})
+        self.assertTrue(all(stats['runs'] == 200 and stats['ops_per_s'] > 0 for stats in report.values()))
+
+class TestTryCalculate(unittest.TestCase):
+    def test_try_calculate(self):
+        table = PrettyTable()
+        table.field_names = ["Выражение", "Единицы измерения", "calculate()", "try_calculate()", "Статус"]
+        table.align = "l"
+
+        def expected(expression, unit, variables):
             try:
-                start_time = time.time()
-                result = calculate(expression)
-                exec_time = time.time() - start_time
-                print("Expression: ", expression, "\n")
-                print("Result: ", result, "\n")
-                print("Time: ", exec_time*1000, "ms\n")
+                return calc.Result(calc.OK, calculate(expression, unit, variables), None)
             except Exception as e:
-                exec_time = time.time() - start_time
-                print("Expression: ", expression, "\n")
-                print("Error: ", str(e), "\n")
-                print("Time : ", exec_time*1000, "ms\n")
+                return str(e)
+
+        # Тот же результат и текст ошибки, что у calculate(), при первом
+        # вызове, из кэша попыток и после компиляции
+        statuses = {"Деление на ноль.": calc.ZERO_DIVISION, "Арифметическое переполнение.": calc.OVERFLOW}
+        expressions = ["2 + 3 * 4", "sin(x) + cos(0)", "1 / 0", "x / (y - 0.5)", "2 ^ 10000", "exp(1000)",
+                       "ln(-1)", "sqrt(-x)", "2 +", "(1 + 2", "1 + 2)", "q + 1", "sin()", "sin(1, 2)",
+                       "f(1)", "2 $ 3", "", "tg(90)", "-2 ^ 2 + y"]
+        for unit in ('radian', 'degree'):
+            cache_clear()
+            for expression in expressions:
+                with self.subTest(expression=expression, unit=unit):
+                    variables = {'x': 2, 'y': 0.5}
+                    reference = expected(expression, unit, variables)
+                    results = [try_calculate(expression, unit, variables) for _ in range(3)]
+                    if isinstance(reference, str):
+                        status = (calc.INVALID if reference.startswith("Некорректное выражение")
+                                  else statuses.get(reference, calc.ERROR))
+                        reference = calc.Result(status, None, reference)
+                    matched = results == [reference] * 3
+                    status = "Тест пройден" if matched else "Тест не пройден"
+                    table.add_row([expression, unit, reference.message or reference.value,
+                                   results[-1].message or results[-1].value, status])
+                    self.assertEqual(results, [reference] * 3)
+                    self.assertEqual(results[0].ok, reference.status == calc.OK)
+
+        # Без кэша результат тот же
+        configure_cache(enabled=False)
+        try:
+            self.assertEqual(try_calculate("1 / 0"), (calc.ZERO_DIVISION, None, "Деление на ноль."))
+            self.assertEqual(try_calculate("2 * x", variables={'x': 3}), (calc.OK, 6, None))
+            self.assertEqual(try_calculate("2 +").status, calc.INVALID)
+        finally:
+            configure_cache(enabled=True)
+        info = cache_info()['attempts']
+        self.assertEqual(info.size, len(expressions))
+        self.assertGreater(info.hits, 0)
+
+        print("\nТесты для вычисления без исключений:")
+        print(table)
+
+    def test_validate(self):
+        # validate() сообщает ту же ошибку, что parse(), но без разбора
+        for expression in ["2 + 3", "sin(x) * y", "2 +", "(1", "1)", "sin", "sin 1", "x y", "1..2",
+                           "2 # 3", "q", "", "()", "sin(1,)", "-(-x)", "2 ^ -x"]:
+            with self.subTest(expression=expression):
+                try:
+                    parse(expression, ['x', 'y'])
+                    reference = (calc.OK, None, None)
+                except ValueError as e:
+                    reference = (calc.INVALID, None, str(e))
+                self.assertEqual(validate(expression, ['x', 'y']), reference)
+
+        # Пакетный режим выводит то же, что раньше
+        self.assertEqual(calc.batch_line("1 / 0"), (False, "Ошибка: Деление на ноль."))
+        self.assertEqual(calc.batch_line("2 *"), (False, "Ошибка: " + validate("2 *").message))
+        self.assertEqual(calc.batch_line("2 * 3"), (True, "6"))
+
+class TestBatchMode(unittest.TestCase):
+    def test_batch_mode(self):
+        table = PrettyTable()
+        table.field_names = [
+            "Формат",
+            "Процессы",
+            "Ввод",
+            "Вывод",
+            "Статус"
+        ]
+        table.align = "l"
+
+        lines = ["1 + 1", "sin(90)", "1 / 0", "", "2 ^ 10"]
+        expected = ["2", "1.0", "Ошибка: Деление на ноль.",
+                    "Ошибка: Некорректное выражение: Неполное выражение", "1024"]
+        for workers in [1, 2]:
+            with self.subTest(fmt="text", workers=workers):
+                output = io.StringIO()
+                errors = run_batch((line + "\n" for line in lines), output, 'degree', 'text', workers, chunksize=2)
+                result = output.getvalue().splitlines()
+                status = "Тест пройден" if result == expected else "Тест не пройден"
+                table.add_row(["text", workers, lines, result, status])
+                self.assertEqual(result, expected)
+                self.assertEqual(errors, 2)
+
+        records = [
+            {"expression": "sin(90)", "angle_unit": "degree", "id": 1},
+            {"expression": "x * y", "variables": {"x": 3, "y": 4}},
+            {"expression": "ln(0)"},
+            {"expression": "1", "angle_unit": "grad"},
+        ]
+        lines = [json.dumps(record) for record in records] + ["[1, 2"]
+        expected = [
+            {"expression": "sin(90)", "angle_unit": "degree", "id": 1, "result": 1.0},
+            {"expression": "x * y", "variables": {"x": 3, "y": 4}, "angle_unit": "radian", "result": 12},
+            {"expression": "ln(0)", "angle_unit": "radian", "error": "Ошибка в функции ln: math domain error"},
+            {"expression": "1", "angle_unit": "grad", "error": "Неизвестные единицы измерения углов: grad"},
+        ]
+        output = io.StringIO()
+        errors = run_batch(lines, output, fmt='jsonl')
+        result = [json.loads(line) for line in output.getvalue().splitlines()]
+        status = "Тест пройден" if result[:4] == expected else "Тест не пройден"
+        table.add_row(["jsonl", 1, len(lines), len(result), status])
+        self.assertEqual(result[:4], expected)
+        self.assertIn("Некорректная строка JSON", result[4]["error"])
+        self.assertEqual(errors, 3)
+
+        # Командная строка читает выражения из stdin
+        process = subprocess.run(
+            [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "calc.py"),
+             "--batch", "--angle-unit", "degree"],
+            input="cos(0)\n2 * 3\n", capture_output=True, text=True, encoding="utf-8")
+        result = process.stdout.splitlines()
+        status = "Тест пройден" if result == ["1.0", "6"] else "Тест не пройден"
+        table.add_row(["text", "stdin", "cos(0), 2 * 3", result, status])
+        self.assertEqual(result, ["1.0", "6"])
+        self.assertEqual(process.returncode, 0)
+
+        print("\nТесты для пакетного режима:")
+        print(table)
+
+class TestCalculateMany(unittest.TestCase):
+    def test_calculate_many(self):
+        table = PrettyTable()
+        table.field_names = ["Процессы", "Пачка", "Результаты", "Статус"]
+        table.align = "l"
+
+        expressions = ["2 + 2", "1 / 0", parse("x ^ 2", ["x"]), ast.parse("3 * x", mode="eval").body,
+                       "ln(0)", "2 +", "x * 10 ^ 400", "sin(x)"]
+        expected = [4, ZeroDivisionError("Деление на ноль."), 9, 9,
+                    ValueError("Ошибка в функции ln: math domain error"),
+                    ValueError("Некорректное выражение: Неполное выражение"),
+                    OverflowError("Арифметическое переполнение."), math.sin(3)]
+        for workers, chunksize in [(1, 256), (2, 1), (2, 3)]:
+            with self.subTest(workers=workers, chunksize=chunksize):
+                results = list(calculate_many(expressions, workers=workers, chunksize=chunksize, variables={"x": 3}))
+                result = [(type(r), str(r)) if isinstance(r, Exception) else r for r in results]
+                want = [(type(r), str(r)) if isinstance(r, Exception) else r for r in expected]
+                status = "Тест пройден" if result == want else "Тест не пройден"
+                table.add_row([workers, chunksize, len(results), status])
+                self.assertEqual(result, want)
+
+        # Глубокие готовые деревья передаются процессам без рекурсии
+        deep = [parse("1+" * 5000 + "1"), parse("-" * 5001 + "x * sin(pi / 2) - e", ["x"]),
+                parse("(" * 5000 + "2" + ")" * 5000 + " / 0")]
+        results = list(calculate_many(deep + ["1 / 0", "2"], workers=2, chunksize=2, variables={"x": 3}))
+        self.assertEqual(results[:2], [5001, -3 - math.e])
+        self.assertEqual([str(r) for r in results[2:4]], ["Деление на ноль."] * 2)
+        self.assertEqual(results[4], 2)
+
+        # Результаты выдаются лениво: бесконечный ввод можно читать по частям
+        results = calculate_many((f"{i} * 2" for i in itertools.count()), workers=2, chunksize=10)
+        self.assertEqual(list(itertools.islice(results, 25)), [i * 2 for i in range(25)])
+        results.close()
+
+        print("\nТесты для calculate_many:")
+        print(table)
+
+class TestServer(unittest.TestCase):
+    def setUp(self):
+        # Сервер работает в отдельном потоке со своим циклом событий
+        self.loop = asyncio.new_event_loop()
+        self.server = self.loop.run_until_complete(calc_server.start_server(port=0, workers=1))
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        async def stop():
+            self.server.close()
+            await self.server.wait_closed()
+            # Дожидаемся обработчиков уже закрытых клиентом соединений
+            tasks = asyncio.all_tasks() - {asyncio.current_task()}
+            await asyncio.gather(*tasks, return_exceptions=True)
+        asyncio.run_coroutine_threadsafe(stop(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.server.pool.shutdown()
+
+    def test_server(self):
+        table = PrettyTable()
+        table.field_names = [
+            "Запрос",
+            "Ожидаемый ответ",
+            "Полученный ответ",
+            "Статус"
+        ]
+        table.align = "l"
+
+        long_expression = "1+" * 5000 + "1"
+        test_cases = [
+            ("2 ^ 10", None, None, 1024),
+            ("sin(90)", 'degree', None, 1.0),
+            ("sqrt(x^2 + y^2)", None, {'x': 3, 'y': 4}, 5.0),
+            (long_expression, None, None, 5001),
+            ("1 / 0", None, None, ZeroDivisionError("Деление на ноль.")),
+            ("a + 1", None, None, ValueError("Некорректное выражение: Выражение содержит неверные символы: a")),
+        ]
+
+        with calc_server.Client(port=self.port) as client:
+            for expression, unit, variables, expected in test_cases:
+                with self.subTest(expression=expression[:20]):
+                    try:
+                        result = client.calculate(expression, unit, variables)
+                    except Exception as e:
+                        result = e
+                    if isinstance(expected, Exception):
+                        matched = type(result) is type(expected) and str(result) == str(expected)
+                    else:
+                        matched = result == expected
+                    status = "Тест пройден" if matched else "Тест не пройден"
+                    table.add_row([expression[:20], expected, result, status])
+                    self.assertTrue(matched)
+
+            # Конвейер: много запросов без ожидания ответов, порядок сохраняется
+            expressions = [f"{i} * 2" if i % 7 else long_expression for i in range(2000)]
+            results = list(client.calculate_many(expressions))
+            expected = [i * 2 if i % 7 else 5001 for i in range(2000)]
+            status = "Тест пройден" if results == expected else "Тест не пройден"
+            table.add_row(["2000 запросов", "в порядке отправки", "в порядке отправки" if results == expected else results[:5], status])
+            self.assertEqual(results, expected)
+
+        print("\nТесты для сервера:")
+        print(table)
+
+    def handlers(self):
+        # Число работающих обработчиков соединений
+        async def count():
+            return len(asyncio.all_tasks() - {asyncio.current_task()})
+        return asyncio.run_coroutine_threadsafe(count(), self.loop).result()
+
+    def test_broken_pool(self):
+        # Сбой пула процессов - ошибка длинного запроса, а не зависание соединения
+        self.server.pool.shutdown()
+        long_expression = "1+" * 5000 + "1"
+        with calc_server.Client(port=self.port, timeout=10) as client:
+            results = list(client.calculate_many([long_expression, "2 * 3"]))
+            self.assertIsInstance(results[0], ValueError)
+            self.assertEqual(results[1], 6)
+        with socket.create_connection(("127.0.0.1", self.port), timeout=10) as connection:
+            connection.sendall((long_expression + "\n2 * 3\n").encode("utf-8"))
+            connection.shutdown(socket.SHUT_WR)
+            lines = connection.makefile(encoding="utf-8").read().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith("Ошибка: "))
+        self.assertEqual(lines[1], "6")
+
+    def test_reset(self):
+        # Клиент отправляет запросы, не читая ответов, и сбрасывает соединение:
+        # обработчик завершается
+        connection = socket.create_connection(("127.0.0.1", self.port))
+        connection.settimeout(0.5)
+        try:
+            connection.sendall(b"1 + 1\n" * 200000)
+        except socket.timeout:
+            pass
+        # Сервер успевает заполнить очередь ответов
+        time.sleep(0.5)
+        connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+        connection.close()
+        deadline = time.monotonic() + 10
+        while self.handlers() and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(self.handlers(), 0)
+
+class TestProfiling(unittest.TestCase):
+    def tearDown(self):
+        calc.disable_profiling()
+
+    def test_profiling(self):
+        table = PrettyTable()
+        table.field_names = ["Выражение", "Узлы", "Глубина", "Функции", "Ошибка", "Статус"]
+        table.align = "l"
+
+        test_cases = [
+            ("2*sin(pi/4) + sin(1)", 9, 5, {"sin": 2}, None),
+            ("sqrt(ln(exp(2)))", 4, 4, {"exp": 1, "ln": 1, "sqrt": 1}, None),
+            ("1 / (2 - 2)", 5, 3, {}, "Деление на ноль."),
+            ("ln(0)", 2, 2, {"ln": 1}, "Ошибка в функции ln: math domain error"),
+            ("2 +", 0, 0, {}, "Некорректное выражение: Неполное выражение"),
+        ]
+        stats = calc.enable_profiling()
+        for expression, nodes, tree_depth, function_calls, error in test_cases:
+            with self.subTest(expression=expression):
+                try:
+                    calculate(expression)
+                except (ValueError, ArithmeticError) as e:
+                    self.assertEqual(str(e), error)
+                profile = stats.last[-1]
+                result = (profile.nodes, profile.depth, profile.function_calls, profile.error)
+                status = "Тест пройден" if result == (nodes, tree_depth, function_calls, error) else "Тест не пройден"
+                table.add_row([expression, profile.nodes, profile.depth, profile.function_calls, profile.error, status])
+                self.assertEqual(result, (nodes, tree_depth, function_calls, error))
+                self.assertEqual(profile.timings['total'],
+                                 sum(profile.timings[stage] for stage in ('tokenize', 'parse', 'postorder', 'evaluate')))
+
+        self.assertEqual((stats.calls, stats.errors, stats.max_depth), (5, 3, 5))
+        self.assertEqual(stats.function_calls, {"sin": 2, "exp": 1, "ln": 2, "sqrt": 1})
+        self.assertIn("sin", stats.report())
+
+        # Переменные, градусы и готовое дерево вычисляются так же, как без профилирования
+        self.assertAlmostEqual(calculate("sin(x)", 'degree', {"x": 90}), 1.0)
+        self.assertEqual(calculate(parse("2 ^ 10")), 1024)
+        self.assertIsNone(stats.last[-1].expression)
+
+        self.assertIs(calc.disable_profiling(), stats)
+        self.assertIsNone(calc.profiler)
+        calculate("sin(1)")
+        self.assertEqual(stats.calls, 7)
+
+        print("\nТесты для профилирования:")
+        print(table)
+
+    def test_cli(self):
+        process = subprocess.run(
+            [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "calc.py"),
+             "--profile", "sqrt(16) + cos(0)"],
+            capture_output=True, text=True, encoding="utf-8")
+        self.assertEqual(process.stdout, "Результат: 5.0\n")
+        self.assertIn("Профиль: вызовов 1, ошибок 0", process.stderr)
+        self.assertIn("sqrt", process.stderr)
+
+class TestTime(unittest.TestCase):
+    def test(self):
+        # Короткий прогон бенчмарков; полный замер: python calc_bench.py
+        profiles = {name: calc_bench.PROFILES[name] for name in ('short', 'trig')}
+        report = calc_bench.run_benchmarks(profiles, repeat=20)
+        table = PrettyTable()
+        table.field_names = ["Сценарий", "Оп/с", "p50, мкс", "p99, мкс"]
+        print("\nНагрузочные тесты:\n")
+        for scenario, stats in report['results'].items():
+            with self.subTest(scenario=scenario):
+                self.assertEqual(stats['runs'], 20)
+                self.assertTrue(stats['min_ns'] <= stats['p50_ns'] <= stats['p90_ns'] <= stats['p99_ns'])
+                table.add_row([scenario, f"{stats['ops_per_s']:.0f}",
+                               f"{stats['p50_ns'] / 1000:.2f}", f"{stats['p99_ns'] / 1000:.2f}"])
+        print(table)
+        for stage in ('parse', 'evaluate', 'calculate-cold', 'calculate-cached', 'trig-degree'):
+            self.assertTrue(any(name.startswith(stage + '/') for name in report['results']), stage)
+        json.loads(json.dumps(report))
+
+    def test_startup(self):
+        # Импорт calc и первое вычисление укладываются в бюджет и не загружают
+        # модули командной строки
+        results, modules = calc_bench.measure_startup(5)
+        import_ms = results['startup/import']['p50_ns'] / 1e6
+        first_call_ms = results['startup/first-call']['p50_ns'] / 1e6
+        print(f"\nИмпорт calc: {import_ms:.2f} мс, первый вызов calculate(): {first_call_ms:.2f} мс")
+        self.assertLess(import_ms, calc_bench.IMPORT_BUDGET_MS)
+        self.assertLess(first_call_ms, calc_bench.FIRST_CALL_BUDGET_MS)
+        for module in ('argparse', 'json', 'threading', 'numpy', 'concurrent.futures'):
+            self.assertNotIn(module, modules)
+
+    def test_generator(self):
+        # Генератор детерминирован и строит вычислимые выражения
+        for profile in calc_bench.PROFILES.values():
+            expression = calc_bench.generate_expression(seed=3, **profile)
+            self.assertEqual(expression, calc_bench.generate_expression(seed=3, **profile))
+            self.assertIsInstance(calculate(expression), float)
+        with_variables = calc_bench.generate_expression(20, 2, variables=('x',), seed=1)
+        self.assertIsInstance(calculate(with_variables, variables={'x': 2}), (int, float))
+
+    def test_compare(self):
+        baseline = {'results': {'a': {'p50_ns': 1000}, 'b': {'p50_ns': 1000}}}
+        report = {'results': {'a': {'p50_ns': 1100}, 'b': {'p50_ns': 1500}, 'c': {'p50_ns': 10}}}
+        self.assertEqual(calc_bench.compare(report, baseline, 0.2), [('b', 1000, 1500, 1.5)])
+        self.assertEqual(calc_bench.compare(report, baseline, 0.6), [])
 
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file